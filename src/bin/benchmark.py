@@ -0,0 +1,185 @@
+#! python3
+"""Benchmarks the website generator on synthetic data of increasing sizes.
+
+Each size is run in a separate process so that its peak memory is measured
+in isolation. Every stage of a build is timed separately and the results
+are written as JSON, which can be compared against the results of an
+earlier commit to catch regressions.
+"""
+import argparse
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from functools import partial
+
+import lib.logger as logger
+import lib.constants as Constants
+from lib.instrumentation import peak_rss_mb
+from lib.loader import Loader
+import lib.synthetic as synthetic
+import lib.utils as Utils
+
+DEFAULT_SIZES = "10000,1000000,10000000"
+DEFAULT_RESULTS_FILE = "benchmark_results.json"
+# Stages faster than this are too noisy to be flagged as regressions
+MIN_COMPARED_SECONDS = 0.05
+
+
+def parse_arguments():
+    """
+    Parses command line arguments
+
+    Returns: Parsed args as object
+    """
+    parser = argparse.ArgumentParser(
+        description="Road Fatalities website generator benchmark")
+    parser.add_argument("--sizes", help="Comma separated numbers of rows of "
+                        "synthetic data to benchmark with. Defaults to %s" % DEFAULT_SIZES,
+                        type=str, default=DEFAULT_SIZES)
+    parser.add_argument("--seed", help="Random seed for the synthetic data",
+                        type=int, default=0)
+    parser.add_argument("--profile", help="Relative path to the data file whose "
+                        "value distributions the synthetic data follows",
+                        type=str, default=Constants.DEFAULT_DATA_FILE)
+    parser.add_argument("--output", help="File the JSON results are written to. "
+                        "Defaults to %s" % DEFAULT_RESULTS_FILE,
+                        type=str, default=DEFAULT_RESULTS_FILE)
+    parser.add_argument("--baseline", help="JSON results of an earlier run to "
+                        "compare against", type=str, required=False)
+    parser.add_argument("--threshold", help="Relative slow down or memory growth "
+                        "over the baseline reported as a regression. Defaults to 0.25",
+                        type=float, default=0.25)
+    parser.add_argument("--worker", help=argparse.SUPPRESS, type=int, required=False)
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS, type=str, required=False)
+    return parser.parse_args()
+
+
+def run_stage(stages, name, func):
+    """Runs func as a benchmarked stage and records its timings.
+
+    Returns: Whatever func returns
+    """
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = func()
+    stages[name] = {
+        "wall_seconds": round(time.perf_counter() - wall, 6),
+        "cpu_seconds": round(time.process_time() - cpu, 6),
+        "peak_rss_mb": round(peak_rss_mb(), 1)
+    }
+    return result
+
+
+def data_file_for(rows, parsed_args):
+    project_dir = Utils.get_project_dir()
+    data_file = os.path.join(project_dir, Constants.RELATIVE_CACHE_DIR, "benchmark",
+                             "synthetic_%d_%d.csv" % (rows, parsed_args.seed))
+    if not Utils.file_exists(data_file):
+        profile = synthetic.Profile.from_csv(os.path.join(project_dir, parsed_args.profile))
+        synthetic.write_csv(data_file, rows, profile, seed=parsed_args.seed)
+    return data_file
+
+
+def benchmark_rows(rows, parsed_args):
+    """Benchmarks all the stages of a build on rows of synthetic data.
+
+    Returns: dict of results
+    """
+    data_file = data_file_for(rows, parsed_args)
+    logger.set_level(logging.WARNING)
+    stages = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        loader_args = argparse.Namespace(data_file=data_file, output_dir=output_dir,
+                                         compare_start_year=None, compare_end_year=None,
+                                         force=True, rebuild_cache=True)
+        loader = run_stage(stages, "load", partial(Loader, loader_args))
+        run_stage(stages, "process_data", loader.process_data)
+        run_stage(stages, "build_cube", loader.build_cube)
+        loader.set_compare_years()
+        for spec in loader.charts:
+            run_stage(stages, "chart:%s" % spec.name, partial(loader.render_chart, spec.name))
+        loader.release_figure()
+        run_stage(stages, "generate_html_pages", loader.generate_html_pages)
+        run_stage(stages, "generate_index_html", loader.generate_index_html)
+    return {
+        "rows": rows,
+        "data_file_bytes": os.path.getsize(data_file),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stages": stages
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=Utils.get_project_dir(),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Lists the stages of results that regressed relative to baseline.
+
+    Returns: List of regression descriptions
+    """
+    regressions = []
+    baseline_runs = dict((run["rows"], run) for run in baseline["runs"])
+    for run in results["runs"]:
+        old_run = baseline_runs.get(run["rows"])
+        if old_run is None:
+            continue
+        if run["peak_rss_mb"] > old_run["peak_rss_mb"] * (1 + threshold):
+            regressions.append("%d rows: peak memory %.1fMB -> %.1fMB" % (
+                run["rows"], old_run["peak_rss_mb"], run["peak_rss_mb"]))
+        for name, stage in run["stages"].items():
+            old_stage = old_run["stages"].get(name)
+            if old_stage is None or old_stage["wall_seconds"] < MIN_COMPARED_SECONDS:
+                continue
+            if stage["wall_seconds"] > old_stage["wall_seconds"] * (1 + threshold):
+                regressions.append("%d rows: %s %.3fs -> %.3fs" % (
+                    run["rows"], name, old_stage["wall_seconds"], stage["wall_seconds"]))
+    return regressions
+
+
+def main():
+    """
+    This method serves as the starting point of the execution
+    """
+    parsed_args = parse_arguments()
+    if parsed_args.worker is not None:
+        Utils.write_to_file(parsed_args.worker_output, Utils.to_json(
+            benchmark_rows(parsed_args.worker, parsed_args)))
+        return
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "runs": []
+    }
+    for rows in [int(size) for size in parsed_args.sizes.split(",")]:
+        logger.INFO("Benchmarking with %d rows", rows)
+        with tempfile.NamedTemporaryFile(suffix=".json") as worker_output:
+            subprocess.check_call([sys.executable, os.path.abspath(__file__),
+                                   "--worker", str(rows), "--worker-output", worker_output.name,
+                                   "--seed", str(parsed_args.seed), "--profile", parsed_args.profile])
+            run = Utils.read_json(worker_output.name)
+        results["runs"].append(run)
+        logger.INFO("Results with %d rows (peak memory %.1fMB):\n%s", rows, run["peak_rss_mb"], "\n".join(
+            "  %-45s %10.3fs" % (name, stage["wall_seconds"]) for name, stage in run["stages"].items()))
+    Utils.write_to_file(os.path.abspath(parsed_args.output), Utils.to_json(results))
+    logger.INFO("Wrote benchmark results to %s", parsed_args.output)
+    if parsed_args.baseline:
+        regressions = compare(results, Utils.read_json(parsed_args.baseline), parsed_args.threshold)
+        for regression in regressions:
+            logger.ERROR("Regression: %s", regression)
+        if regressions:
+            sys.exit(1)
+        logger.INFO("No regressions against %s", parsed_args.baseline)
+
+
+if __name__ == '__main__':
+    main()
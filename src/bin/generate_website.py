@@ -2,10 +2,37 @@
 
 import argparse
 import os
+import sys
 from pprint import pformat
 
+import lib.constants as Constants
+import lib.images as images
 import lib.logger as logger
-from lib.loader import Loader
+from lib.loader import ArgumentError, Loader
+from lib.partitions import DataSource
+from lib.shards import MergeError, Shard
+import lib.shards as shards
+from lib.watcher import Watcher
+import lib.registry as registry
+import lib.utils as Utils
+
+
+def comma_separated(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def comma_separated_ints(value):
+    try:
+        return [int(item) for item in comma_separated(value)]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected comma separated integers, got %s" % value)
+
+
+def shard_spec(value):
+    try:
+        return Shard.parse(value)
+    except ValueError as ex:
+        raise argparse.ArgumentTypeError(str(ex))
 
 
 def parse_arguments():
@@ -19,7 +46,13 @@ def parse_arguments():
     parser = argparse.ArgumentParser(
         description="Road Fatalities website updater")
     parser.add_argument("-f", "--data_file", help="Relative path to "
-                        'fatalities data file in csv format inside the project directory',
+                        "fatalities data file in csv format inside the project directory. "
+                        "Can also be a directory or a glob pattern of csv partition files, "
+                        "eg: 'data/traffic_*.csv'. Partitions named after a year are only "
+                        "read when the selected charts need that year.",
+                        type=str, required=False)
+    parser.add_argument("-o", "--output_dir", help="Directory under which the "
+                        "static website is generated. Defaults to the project directory.",
                         type=str, required=False)
     parser.add_argument("-s", "--compare_start_year", help="Year1 or start year "
                         'for generating comparison statistics between two years.'
@@ -29,10 +62,168 @@ def parse_arguments():
                         'for generating comparison statistics between two years.'
                         "Defaults to maximum year in the given data.",
                         type=int, required=False)
+    parser.add_argument("--compare-all", help="Also generate the comparison "
+                        "charts of every pair of years in the data along with a "
+                        "compare.html page linking them",
+                        required=False, action='store_true')
+    parser.add_argument("--compare-baseline", help="Also generate the comparison "
+                        "charts of every year in the data against this year along "
+                        "with a compare.html page linking them",
+                        type=int, required=False)
+    parser.add_argument("--compare-batch-size", help="Number of year pairs whose "
+                        "comparison charts are rendered as one batch by a worker "
+                        "process. Defaults to 10.",
+                        type=int, default=10, required=False)
+    parser.add_argument("--charts", help="Comma separated chart names or fields "
+                        "to generate, eg: state,hour or fatalities_by_hour_compare. "
+                        "Defaults to all charts.",
+                        type=comma_separated, required=False)
+    parser.add_argument("--group", help="Comma separated html page groups to "
+                        "generate along with their charts, eg: dayweek_hour_year",
+                        type=comma_separated, required=False)
+    parser.add_argument("--state-pages", help="Also generate a page per state "
+                        "with the selected charts, other than the state and compare "
+                        "charts, drawn from the rows of that state only. Linked from "
+                        "the States menu of every page.",
+                        required=False, action='store_true')
+    parser.add_argument("-i", "--incremental", help="Only read the rows appended "
+                        "to the data file since the last incremental run and merge "
+                        "their counts into the persisted ones. Falls back to reading "
+                        "the whole file when it was rewritten rather than appended to.",
+                        required=False, action='store_true')
+    parser.add_argument("--watch", help="Keep running and regenerate the "
+                        "charts and pages affected by every change of the data file, "
+                        "ingesting only the appended rows as with --incremental",
+                        required=False, action='store_true')
+    parser.add_argument("--watch-interval", help="Seconds between checks of "
+                        "the data file for changes in watch mode. Defaults to 0.2.",
+                        type=float, default=0.2, required=False)
+    parser.add_argument("--debounce", help="Seconds the data file has to stay "
+                        "unchanged before the website is regenerated in watch mode. "
+                        "Defaults to 0.3.",
+                        type=float, default=0.3, required=False)
+    parser.add_argument("--quarantine-file", help="csv file the rows failing "
+                        "validation are written to along with the reasons they were "
+                        "rejected, relative to the output directory. Defaults to "
+                        "quarantine.csv.",
+                        type=str, required=False)
+    parser.add_argument("--rebuild-cache", help="Re-read and process the data "
+                        "file even when a valid cache of the processed data exists, "
+                        "and regenerate that cache",
+                        required=False, action='store_true')
+    parser.add_argument("--chunk-size", help="Stream the data file in chunks "
+                        "of this many rows instead of loading all of it in memory",
+                        type=int, required=False)
+    parser.add_argument("--memory-report", help="Print the memory footprint "
+                        "of each column of the processed data before and after "
+                        "conversion to the compact schema",
+                        required=False, action='store_true')
+    parser.add_argument("--output-format", help="jpg renders the charts as "
+                        "images, json writes the data of each chart for the pages to "
+                        "draw in the browser, which needs the website to be served over "
+                        "http. Defaults to jpg.",
+                        choices=["jpg", "json"], default="jpg", required=False)
+    parser.add_argument("--image-format", help="Format the charts are saved "
+                        "in. Defaults to jpg.",
+                        choices=list(images.FORMATS), default="jpg", required=False)
+    parser.add_argument("--dpi", help="Comma separated resolutions to save each "
+                        "chart at, eg: 72,150,300. The pages let browsers pick the "
+                        "variant fitting the screen. Defaults to the figure resolution.",
+                        type=comma_separated_ints, required=False)
+    parser.add_argument("--hashed-filenames", help="Name the chart images after "
+                        "a hash of their content so that they can be cached forever",
+                        required=False, action='store_true')
+    parser.add_argument("-j", "--jobs", help="Number of worker processes "
+                        "used to render the charts in parallel. Defaults to 1 "
+                        "which renders all charts in the main process.",
+                        type=int, default=1, required=False)
+    parser.add_argument("--reuse-figure", help="Clear and redraw a single "
+                        "figure for all the charts rendered by a process instead "
+                        "of allocating a new figure per chart",
+                        required=False, action='store_true')
+    parser.add_argument("--shard", help="Only generate shard K of N of the "
+                        "charts and pages, eg: 2/4, along with a manifest of them under "
+                        "the shards directory. Once the outputs of all the shards are "
+                        "gathered in one output directory, the merge command completes "
+                        "the website.",
+                        type=shard_spec, required=False)
+    parser.add_argument("--force", help="Re-render all the charts even when "
+                        "their inputs did not change since the last run",
+                        required=False, action='store_true')
+    parser.add_argument("--report", help="Write a JSON report of the wall "
+                        "time, CPU time, rows in/out, peak memory growth and bytes "
+                        "written of each stage of the run to this file",
+                        type=str, required=False)
+    parser.add_argument("--profile", help="Dump a cProfile file of each stage "
+                        "of the run in this directory, eg: to inspect with "
+                        "python -m pstats", type=str, required=False)
+    parser.add_argument("--log-file", help="Also write the logs to this file",
+                        type=str, required=False)
+    parser.add_argument("--log-queue", help="Hand the logs to a background "
+                        "thread that writes them out, so that logging does not "
+                        "block on the console or the log file",
+                        required=False, action='store_true')
     parser.add_argument("-d", "--debug", help="Enable debug logs",
                         required=False, action='store_true')
+    subparsers = parser.add_subparsers(dest="command", metavar="{merge}")
+    merge_parser = subparsers.add_parser("merge", help="Check that the shards of a "
+                                         "build generated every chart and page exactly "
+                                         "once, then write the charts manifest and index.html")
+    merge_parser.add_argument("-o", "--output_dir", help="Directory the outputs "
+                              "of all the shards were gathered under. Defaults to the "
+                              "project directory.",
+                              # Keeps the -o given before the merge command
+                              type=str, default=argparse.SUPPRESS, required=False)
+    merge_parser.add_argument("manifests", help="Manifests of the shards. "
+                              "Defaults to all of those under the shards directory of "
+                              "the output directory.",
+                              nargs="*")
 
     parsed_args = parser.parse_args()
+    if parsed_args.command == "merge":
+        if parsed_args.debug:
+            logger.set_level(logger.logging.DEBUG)
+        return parsed_args
+    try:
+        registry.select(charts=parsed_args.charts, groups=parsed_args.group)
+        data_source = DataSource.resolve(os.path.join(
+            Utils.get_project_dir(), parsed_args.data_file or Constants.DEFAULT_DATA_FILE))
+    except ValueError as ex:
+        parser.error(str(ex))
+    if parsed_args.state_pages and not any(
+            not spec.compare and spec.field != Constants.FACET_FIELD
+            for spec in registry.select(charts=parsed_args.charts, groups=parsed_args.group)):
+        parser.error("--state-pages needs charts other than the state and compare charts")
+    if not data_source.is_single_file and (parsed_args.incremental or parsed_args.watch):
+        parser.error("--incremental and --watch need a single data file")
+    if parsed_args.shard and (parsed_args.incremental or parsed_args.watch):
+        parser.error("--shard can not be combined with --incremental or --watch")
+    # The pages of a shard refer to the charts of the other shards by the
+    # file names they would be saved under
+    if parsed_args.shard and (parsed_args.hashed_filenames or len(parsed_args.dpi or ()) > 1):
+        parser.error("--shard can not be combined with --hashed-filenames or several --dpi")
+    if parsed_args.compare_all and parsed_args.compare_baseline is not None:
+        parser.error("--compare-all can not be combined with --compare-baseline")
+    if parsed_args.compare_batch_size < 1:
+        parser.error("--compare-batch-size must be at least 1")
+    if parsed_args.dpi is not None and (not parsed_args.dpi or min(parsed_args.dpi) < 1):
+        parser.error("--dpi must be positive")
+    if parsed_args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if parsed_args.chunk_size is not None and parsed_args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    if parsed_args.chunk_size and parsed_args.incremental:
+        parser.error("--chunk-size can not be combined with --incremental")
+    if parsed_args.chunk_size and parsed_args.watch:
+        parser.error("--chunk-size can not be combined with --watch")
+    # Streamed chunks are counted and dropped, there is no processed frame to report on
+    if parsed_args.chunk_size and parsed_args.memory_report:
+        parser.error("--chunk-size can not be combined with --memory-report")
+    if parsed_args.watch_interval <= 0 or parsed_args.debounce < 0:
+        parser.error("--watch-interval must be positive and --debounce not negative")
+    if parsed_args.log_file or parsed_args.log_queue:
+        logger.setup_logging(log_level=logger.get_level(), log_file=parsed_args.log_file,
+                             use_queue=parsed_args.log_queue)
     if parsed_args.debug:
         logger.set_level(logger.logging.DEBUG)
     return parsed_args
@@ -45,7 +236,7 @@ def print_details(parsed_args):
     Args:
       parsed_args(object): Parsed args
     """
-    logger.INFO("Arguments passed:\n%s" % pformat(parsed_args))
+    logger.INFO("Arguments passed:\n%s", pformat(parsed_args))
 
 
 def main():
@@ -54,8 +245,25 @@ def main():
     """
     parsed_args = parse_arguments()
     print_details(parsed_args)
+    if parsed_args.command == "merge":
+        try:
+            shards.merge(os.path.abspath(parsed_args.output_dir or Utils.get_project_dir()),
+                         parsed_args.manifests)
+        except MergeError as ex:
+            logger.ERROR("%s", ex)
+            sys.exit(1)
+        return
     loader = Loader(parsed_args=parsed_args)
-    loader.run()
+    try:
+        if parsed_args.watch:
+            Watcher(loader, interval=parsed_args.watch_interval,
+                    debounce=parsed_args.debounce).run()
+        else:
+            loader.run()
+    except ArgumentError as ex:
+        # Arguments checked against the data, which is only known once loaded
+        logger.ERROR("%s", ex)
+        sys.exit(2)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,82 @@
+#! python3
+
+import argparse
+import os
+
+import lib.logger as logger
+from lib.loader import Loader
+from lib.server import CountsQuery, PreviewServer
+import lib.utils as Utils
+
+
+def parse_arguments():
+    """
+    Parses command line arguments
+
+    Returns: Parsed args as object
+
+    Raises: argparse.ArgumentError exception
+    """
+    parser = argparse.ArgumentParser(
+        description="Road Fatalities website preview server")
+    parser.add_argument("-f", "--data_file", help="Relative path to "
+                        "fatalities data file in csv format inside the project directory. "
+                        "Can also be a directory or a glob pattern of csv partition files.",
+                        type=str, required=False)
+    parser.add_argument("-o", "--output_dir", help="Directory the static "
+                        "website was generated under. Defaults to the project directory.",
+                        type=str, required=False)
+    parser.add_argument("--host", help="Address to listen on. Defaults to "
+                        "127.0.0.1, which only accepts local connections.",
+                        type=str, default="127.0.0.1", required=False)
+    parser.add_argument("-p", "--port", help="Port to listen on. Defaults to 8000.",
+                        type=int, default=8000, required=False)
+    parser.add_argument("--cache-size", help="Number of distinct query "
+                        "answers kept in memory. Defaults to 256.",
+                        type=int, default=256, required=False)
+    parser.add_argument("--workers", help="Number of threads answering the "
+                        "queries and reading the files. Defaults to the number "
+                        "of CPUs plus 4, at most 32.",
+                        type=int, required=False)
+    parser.add_argument("--rebuild-cache", help="Re-read and process the data "
+                        "file even when a valid cache of the processed data exists, "
+                        "and regenerate that cache",
+                        required=False, action='store_true')
+    parser.add_argument("-d", "--debug", help="Enable debug logs",
+                        required=False, action='store_true')
+
+    parsed_args = parser.parse_args()
+    if not 0 <= parsed_args.port <= 65535:
+        parser.error("--port must be between 0 and 65535")
+    if parsed_args.cache_size < 0:
+        parser.error("--cache-size can not be negative")
+    if parsed_args.workers is not None and parsed_args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if parsed_args.debug:
+        logger.set_level(logger.logging.DEBUG)
+    return parsed_args
+
+
+def main():
+    """
+    This method serves as the starting point of the execution
+    """
+    parsed_args = parse_arguments()
+    loader = Loader(parsed_args=parsed_args)
+    loader.ensure_processed()
+    static_dir = os.path.join(loader.output_dir, "static")
+    if not Utils.file_exists(os.path.join(static_dir, "index.html")):
+        logger.WARN("%s has no index.html, run bin/generate_website.py first", static_dir)
+    mounts = {"/static/": static_dir}
+    # Served where the download links of the pages point at
+    data_dir = os.path.relpath(loader.data_source.root, loader.output_dir)
+    if data_dir != "." and not data_dir.startswith(".."):
+        mounts["/%s/" % data_dir.replace(os.sep, "/")] = loader.data_source.root
+    server = PreviewServer(mounts,
+                           CountsQuery(loader.fatalities_df, cache_size=parsed_args.cache_size),
+                           workers=parsed_args.workers)
+    server.run(parsed_args.host, parsed_args.port)
+
+
+if __name__ == '__main__':
+    main()
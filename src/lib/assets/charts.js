@@ -0,0 +1,251 @@
+/*
+ * Renders the JSON chart payloads written by lib/payload.py as SVG.
+ *
+ * Every element with a data-chart attribute is replaced by the chart of
+ * the payload at that url. Self contained so that the charts render without
+ * network access. Hovering over bars, points and slices shows their counts.
+ */
+(function () {
+  "use strict";
+
+  var SVG_NS = "http://www.w3.org/2000/svg";
+  var WIDTH = 640, HEIGHT = 400;
+  var MARGIN = {top: 30, right: 20, bottom: 80, left: 60};
+  var COLORS = ["#4c72b0", "#dd8452", "#55a868", "#c44e52", "#8172b3",
+                "#937860", "#da8bc3", "#8c8c8c", "#ccb974", "#64b5cd"];
+
+  function el(name, attrs, parent, text) {
+    var node = document.createElementNS(SVG_NS, name);
+    Object.keys(attrs || {}).forEach(function (key) {
+      node.setAttribute(key, attrs[key]);
+    });
+    if (text !== undefined) {
+      node.textContent = text;
+    }
+    if (parent) {
+      parent.appendChild(node);
+    }
+    return node;
+  }
+
+  function tooltip(node, text) {
+    el("title", {}, node, text);
+  }
+
+  function svgFor(container, width, height) {
+    return el("svg", {viewBox: "0 0 " + width + " " + height, width: "100%",
+                      role: "img", "font-family": "sans-serif", "font-size": 11},
+              container);
+  }
+
+  function niceMax(value) {
+    if (value <= 0) {
+      return 1;
+    }
+    var magnitude = Math.pow(10, Math.floor(Math.log10(value)));
+    var steps = [1, 2, 2.5, 5, 10];
+    for (var i = 0; i < steps.length; i++) {
+      if (steps[i] * magnitude >= value) {
+        return steps[i] * magnitude;
+      }
+    }
+    return 10 * magnitude;
+  }
+
+  function legend(svg, series, x, y) {
+    if (series.length < 2) {
+      return;
+    }
+    series.forEach(function (s, i) {
+      el("rect", {x: x, y: y + i * 16, width: 10, height: 10, fill: COLORS[i % COLORS.length]}, svg);
+      el("text", {x: x + 14, y: y + i * 16 + 9}, svg, s.name);
+    });
+  }
+
+  function axes(svg, payload, yMax, plot) {
+    var ticks = 5;
+    for (var i = 0; i <= ticks; i++) {
+      var value = yMax * i / ticks;
+      var y = plot.bottom - plot.height * i / ticks;
+      el("line", {x1: plot.left, x2: plot.right, y1: y, y2: y, stroke: "#e5e5e5"}, svg);
+      el("text", {x: plot.left - 6, y: y + 4, "text-anchor": "end"}, svg,
+         Math.round(value * 100) / 100);
+    }
+    el("line", {x1: plot.left, x2: plot.right, y1: plot.bottom, y2: plot.bottom, stroke: "#333"}, svg);
+    el("text", {x: (plot.left + plot.right) / 2, y: HEIGHT - 8, "text-anchor": "middle",
+                "font-size": 13}, svg, payload.x_label);
+    el("text", {x: 14, y: (plot.top + plot.bottom) / 2, "text-anchor": "middle", "font-size": 13,
+                transform: "rotate(-90 14 " + (plot.top + plot.bottom) / 2 + ")"}, svg, payload.y_label);
+  }
+
+  function xLabels(svg, labels, plot, slot, offset) {
+    var rotate = labels.length > 12 || labels.some(function (label) {
+      return String(label).length > 6;
+    });
+    // Thin out the labels that would not fit
+    var every = Math.max(1, Math.ceil(labels.length / (rotate ? 40 : 16)));
+    labels.forEach(function (label, i) {
+      if (i % every) {
+        return;
+      }
+      var x = plot.left + slot * i + offset;
+      var attrs = {x: x, y: plot.bottom + 14, "text-anchor": rotate ? "end" : "middle"};
+      if (rotate) {
+        attrs.transform = "rotate(-60 " + x + " " + (plot.bottom + 14) + ")";
+      }
+      el("text", attrs, svg, label);
+    });
+  }
+
+  function seriesMax(payload) {
+    var max = 0;
+    payload.series.forEach(function (s) {
+      s.values.forEach(function (value) {
+        max = Math.max(max, value);
+      });
+    });
+    return niceMax(max);
+  }
+
+  function plotArea() {
+    return {left: MARGIN.left, right: WIDTH - MARGIN.right, top: MARGIN.top,
+            bottom: HEIGHT - MARGIN.bottom, height: HEIGHT - MARGIN.top - MARGIN.bottom,
+            width: WIDTH - MARGIN.left - MARGIN.right};
+  }
+
+  function drawBars(container, payload) {
+    var svg = svgFor(container, WIDTH, HEIGHT);
+    var plot = plotArea();
+    var yMax = seriesMax(payload);
+    var labels = payload.labels;
+    var slot = plot.width / Math.max(labels.length, 1);
+    var histogram = payload.kind === "histogram";
+    // Histograms of several series are drawn side by side within a bin
+    var gap = histogram && payload.series.length === 1 ? 0 : slot * 0.15;
+    var barWidth = (slot - 2 * gap) / payload.series.length;
+    axes(svg, payload, yMax, plot);
+    payload.series.forEach(function (s, si) {
+      s.values.forEach(function (value, i) {
+        var height = plot.height * value / yMax;
+        var bar = el("rect", {x: plot.left + slot * i + gap + barWidth * si, y: plot.bottom - height,
+                              width: Math.max(barWidth - (histogram ? 0.5 : 0), 0.5), height: height,
+                              fill: COLORS[si % COLORS.length]}, svg);
+        var label = histogram ? labels[i] + "-" + (labels[i] + payload.bin_size - 1) : labels[i];
+        tooltip(bar, s.name + ", " + label + ": " + value);
+      });
+    });
+    if (histogram) {
+      quartiles(svg, payload, plot, slot);
+    }
+    xLabels(svg, labels, plot, slot, histogram ? 0 : slot / 2);
+    legend(svg, payload.series, plot.right - 60, plot.top);
+  }
+
+  // Shades the interquartile range of each histogram series and marks its median
+  function quartiles(svg, payload, plot, slot) {
+    payload.series.forEach(function (s, si) {
+      if (!s.quartiles || s.quartiles[1] === null) {
+        return;
+      }
+      var color = COLORS[si % COLORS.length];
+      var x = s.quartiles.map(function (value) {
+        return plot.left + slot * value / payload.bin_size;
+      });
+      tooltip(el("rect", {x: x[0], y: plot.top, width: Math.max(x[2] - x[0], 1), height: plot.height,
+                          fill: color, "fill-opacity": 0.1}, svg),
+              s.name + ", 25th to 75th percentile: " + s.quartiles[0] + "-" + s.quartiles[2]);
+      tooltip(el("line", {x1: x[1], x2: x[1], y1: plot.top, y2: plot.bottom, stroke: color,
+                          "stroke-width": 2, "stroke-dasharray": "6,4"}, svg),
+              s.name + ", median: " + s.quartiles[1]);
+    });
+  }
+
+  function drawLines(container, payload) {
+    var svg = svgFor(container, WIDTH, HEIGHT);
+    var plot = plotArea();
+    var yMax = seriesMax(payload);
+    var labels = payload.labels;
+    var slot = plot.width / Math.max(labels.length - 1, 1);
+    axes(svg, payload, yMax, plot);
+    payload.series.forEach(function (s, si) {
+      var color = COLORS[si % COLORS.length];
+      var points = s.values.map(function (value, i) {
+        return [plot.left + slot * i, plot.bottom - plot.height * value / yMax];
+      });
+      el("polyline", {points: points.map(function (p) { return p.join(","); }).join(" "),
+                      fill: "none", stroke: color, "stroke-width": 2.5}, svg);
+      points.forEach(function (p, i) {
+        tooltip(el("circle", {cx: p[0], cy: p[1], r: 3, fill: color}, svg),
+                s.name + ", " + labels[i] + ": " + s.values[i]);
+      });
+    });
+    xLabels(svg, labels, plot, slot, 0);
+    legend(svg, payload.series, plot.right - 60, plot.top);
+  }
+
+  function drawPies(container, payload) {
+    var count = payload.series.length;
+    var size = 360;
+    var svg = svgFor(container, size * count, size);
+    payload.series.forEach(function (s, si) {
+      var cx = size * si + size / 2, cy = size / 2 + 10, radius = size / 2 - 70;
+      var total = s.values.reduce(function (a, b) { return a + b; }, 0);
+      if (count > 1) {
+        el("text", {x: cx, y: 16, "text-anchor": "middle", "font-size": 13}, svg, s.name);
+      }
+      var angle = 0;
+      s.values.forEach(function (value, i) {
+        if (!value) {
+          return;
+        }
+        var share = value / total;
+        var end = angle + share * 2 * Math.PI;
+        var large = share > 0.5 ? 1 : 0;
+        var x1 = cx + radius * Math.sin(angle), y1 = cy - radius * Math.cos(angle);
+        var x2 = cx + radius * Math.sin(end), y2 = cy - radius * Math.cos(end);
+        var path = share === 1 ?
+            "M" + (cx - radius) + "," + cy + "a" + radius + "," + radius + " 0 1,0 " + 2 * radius + ",0" +
+            "a" + radius + "," + radius + " 0 1,0 " + -2 * radius + ",0" :
+            "M" + cx + "," + cy + "L" + x1 + "," + y1 + "A" + radius + "," + radius + " 0 " + large +
+            ",1 " + x2 + "," + y2 + "Z";
+        var slice = el("path", {d: path, fill: COLORS[i % COLORS.length], stroke: "#fff"}, svg);
+        var percent = (share * 100).toFixed(1) + "%";
+        tooltip(slice, payload.labels[i] + ": " + value + " (" + percent + ")");
+        var middle = (angle + end) / 2;
+        var lx = cx + (radius + 14) * Math.sin(middle), ly = cy - (radius + 14) * Math.cos(middle);
+        el("text", {x: lx, y: ly, "text-anchor": Math.sin(middle) >= 0 ? "start" : "end"}, svg,
+           payload.labels[i] + " " + percent);
+        angle = end;
+      });
+    });
+  }
+
+  var RENDERERS = {bar: drawBars, histogram: drawBars, line: drawLines, pie: drawPies};
+
+  function render(container) {
+    var url = container.getAttribute("data-chart");
+    fetch(url).then(function (response) {
+      if (!response.ok) {
+        throw new Error(response.status + " " + response.statusText);
+      }
+      return response.json();
+    }).then(function (payload) {
+      container.setAttribute("title", payload.title);
+      RENDERERS[payload.kind](container, payload);
+    }).catch(function (error) {
+      // Browsers do not fetch files from file:// urls
+      container.textContent = "Could not load " + url + " (" + error.message + "). " +
+        "Serve the website over http, eg: with bin/preview_server.py";
+    });
+  }
+
+  function renderAll() {
+    Array.prototype.forEach.call(document.querySelectorAll("[data-chart]"), render);
+  }
+
+  if (document.readyState === "loading") {
+    document.addEventListener("DOMContentLoaded", renderAll);
+  } else {
+    renderAll();
+  }
+})();
@@ -0,0 +1,76 @@
+"""Content addressed build cache for the generated charts.
+
+Each chart is fingerprinted from the aggregated data it plots along with the
+settings that affect how it looks. The fingerprints of the last build are
+kept in a JSON manifest, along with the files each chart was saved as, so
+that a rerun only re-renders the charts whose fingerprint changed.
+"""
+import hashlib
+
+import pandas as pd
+
+import lib.utils as Utils
+
+MANIFEST_VERSION = 2
+
+
+class BuildCache(object):
+    def __init__(self, manifest_path, force=False):
+        """
+        Args:
+          manifest_path (str): Path of the JSON manifest holding the fingerprints
+          force (bool): When True, no output is considered up to date but the
+                        manifest is still refreshed at the end of the build
+        """
+        self.manifest_path = manifest_path
+        self.force = force
+        manifest = Utils.read_json(manifest_path, default={})
+        # Manifests of older versions are dropped, re-rendering every chart once
+        if manifest.get("version") != MANIFEST_VERSION:
+            manifest = {}
+        self.fingerprints = manifest.get("fingerprints", {})
+        self.outputs = manifest.get("outputs", {})
+
+    @staticmethod
+    def fingerprint(*parts):
+        """Computes a stable digest of the given parts.
+
+        pandas objects are hashed by their values, index and dtypes, anything
+        else (numpy scalars as their python equivalent) by its repr.
+
+        Returns: Hex digest string
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, (pd.Series, pd.DataFrame)):
+                columns = list(part.columns) if isinstance(
+                    part, pd.DataFrame) else part.name
+                digest.update(repr((type(part).__name__, columns, list(part.index.names),
+                                    str(part.dtypes))).encode())
+                digest.update(pd.util.hash_pandas_object(
+                    part, index=True).values.tobytes())
+            else:
+                digest.update(repr(Utils.to_builtin(part)).encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def is_current(self, name, fingerprint, output_paths):
+        """Whether the outputs of name were built from the same fingerprint"""
+        return (not self.force and self.fingerprints.get(name) == fingerprint
+                and bool(output_paths) and all(Utils.file_exists(path) for path in output_paths))
+
+    def update(self, fingerprints, outputs=None):
+        """
+        Args:
+          fingerprints (dict): Map of output name to its fingerprint
+          outputs (dict): Map of output name to the files it was saved as
+        """
+        self.fingerprints.update(fingerprints)
+        self.outputs.update(outputs or {})
+
+    def save(self):
+        Utils.write_to_file(self.manifest_path, Utils.to_json({
+            "version": MANIFEST_VERSION,
+            "fingerprints": self.fingerprints,
+            "outputs": self.outputs
+        }), only_if_changed=True)
@@ -2,10 +2,68 @@ import os
 
 DEFAULT_DATA_FILE = os.path.join("data", "traffic.csv")
 RELATIVE_CHARTS_DIR = os.path.join("static", "images", "auto", "charts")
+RELATIVE_CHARTS_MANIFEST = os.path.join(
+    "static", "images", "auto", "charts_manifest.json")
+RELATIVE_PAYLOADS_DIR = os.path.join("static", "auto", "data")
+RELATIVE_CHART_SCRIPT = os.path.join("static", "js", "charts.js")
+RELATIVE_CACHE_DIR = "cache"
+# Manifests of the shards of a build, see lib/shards.py
+RELATIVE_SHARDS_DIR = "shards"
+# Rows of the data file failing validation, relative to the output directory
+RELATIVE_QUARANTINE_FILE = "quarantine.csv"
 PRIMARY_ROAD_USERS = ('Driver', 'Passenger', 'Motorcycle rider', 'Pedestrian')
 INVOLVEMENT_COLUMNS = ['bus_involvement',
                        'rigid_truck_involvement', 'articulated_truck_involvement']
+# Columns of the data file with their dtypes. When streaming, the text ones
+# are read with these dtypes and the numeric ones are inferred. All of them
+# are validated, rows missing any of them are quarantined.
+INPUT_DTYPES = {
+    "id": "float64",
+    "state": "object",
+    "month": "object",
+    "year": "float64",
+    "dayweek": "object",
+    "crash_type": "object",
+    "bus_involvement": "object",
+    "rigid_truck_involvement": "object",
+    "articulated_truck_involvement": "object",
+    "speed_limit": "float64",
+    "road_user": "object",
+    "gender": "object",
+    "age": "float64",
+    "time": "object"
+}
+# Columns holding whole numbers, read as floats to allow for missing values
+INTEGER_COLUMNS = ["year", "speed_limit", "age"]
+# Category orders of the low cardinality text columns. Values missing here
+# are kept, after these, as extra categories.
+CATEGORIES = {
+    "state": ["Australian Capital Territory", "New South Wales", "Northern Territory", "Queensland",
+              "South Australia", "Tasmania", "Victoria", "Western Australia"],
+    "month": ["January", "February", "March", "April", "May", "June", "July",
+              "August", "September", "October", "November", "December"],
+    "dayweek": ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"],
+    "crash_type": ["Multiple Vehicle", "Single Vehicle"],
+    "road_user": sorted(PRIMARY_ROAD_USERS + ('Other',)),
+    "gender": ["Female", "Male"]
+}
+# Other text columns stored as categoricals, in sorted order of their values
+CATEGORICAL_COLUMNS = ["time"]
+BOOLEAN_COLUMNS = INVOLVEMENT_COLUMNS + ["involvement"]
 STARTING_YEAR = 2006
+# Declared schema the rows of the data file are validated against, see
+# lib/validation.py. Ranges are inclusive.
+VALID_RANGES = {
+    "age": (0, 120),
+    "speed_limit": (5, 130)
+}
+# HH:MM, with single digit hours as well, eg: 7:05
+VALID_TIME_PATTERN = r"^([01]?[0-9]|2[0-3]):[0-5][0-9]$"
+# Text columns taking no values other than their CATEGORIES. Other road
+# users are grouped as Other, and genders other than the declared ones are
+# kept as extra categories.
+CLOSED_CATEGORY_COLUMNS = ["state", "month", "dayweek", "crash_type"]
+YES_NO_VALUES = ["yes", "no"]
 STEP_SIZE = 5
 GROUPS = [
     ["age", "gender"],
@@ -15,3 +73,21 @@ GROUPS = [
     ["crash_type"],
     ["speed_limit"]
 ]
+# Titles of the html page of each group in the navigation bar
+GROUP_TITLES = {
+    "age_gender": "Age and Gender",
+    "state": "State",
+    "dayweek_hour_year": "Dayweek, Hour and Year",
+    "road_user": "Road User Role",
+    "crash_type": "Crash Type",
+    "speed_limit": "Speed Limit"
+}
+# Field the drill-down pages split the data by, see --state-pages
+FACET_FIELD = "state"
+# Fields counted by year in the aggregation cube the charts are drawn from
+CUBE_FIELDS = [field for grp in GROUPS for field in grp if field != "year"]
+CHART_STYLE = {
+    "context": "notebook",
+    "font_scale": 1.5,
+    "rc": {"lines.linewidth": 2.5}
+}
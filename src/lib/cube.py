@@ -0,0 +1,202 @@
+"""Precomputed fatality counts shared by all the charts.
+
+The cube holds, for every charted field, a year x value table of counts that
+is built in one vectorized pass over the processed data. Charts (and any
+other consumer) then slice these small tables instead of grouping the full
+data frame again.
+
+The cube can also be split by the values of a facet field, eg: state, in the
+same pass. Each value then gets a cube of its own, counting its rows only,
+which the per state pages are drawn from with the same methods.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from lib.distribution import Distribution
+from lib.schema import value_sort_key
+
+COUNT_COLUMN = 'Road Fatalities'
+
+
+class CountCube(object):
+    def __init__(self, year_counts, counts, facets=None):
+        """
+        Args:
+          year_counts (pandas.Series): Counts indexed by year
+          counts (dict): Map of field name to a DataFrame of counts indexed by
+                         year with one column per value of the field
+          facets (dict): Map of each value of the facet field to the
+                         CountCube of its rows. Defaults to no facets
+        """
+        self.year_counts = year_counts
+        self.counts = counts
+        self.facets = facets or {}
+        self._year_slices = {}
+
+    @classmethod
+    def build(cls, df, fields, facet=None):
+        """Counts the fatalities by year for each of the given fields.
+
+        Years are factorized once and every field is then counted with a
+        single np.bincount over the combined (year, value) codes. With a
+        facet, the codes also combine the facet value, so that the counts of
+        every facet value come out of that same np.bincount.
+
+        Args:
+          df (pandas.DataFrame): Processed fatalities data
+          fields (list): Fields to be counted
+          facet (str): Field to also split the counts by, eg: state.
+                       Defaults to None
+
+        Returns: CountCube object
+        """
+        year_codes, years = pd.factorize(df['year'], sort=True)
+        year_index = pd.Index(years, name='year')
+        year_counts = pd.Series(np.bincount(year_codes, minlength=len(years)), index=year_index)
+        # Rows are coded by year, or by (facet value, year) pair with a facet
+        row_codes, groups = year_codes, 1
+        if facet is not None:
+            facet_codes, facet_values = pd.factorize(df[facet], sort=True)
+            row_codes, groups = facet_codes * len(years) + year_codes, len(facet_values)
+            facet_year_counts = np.bincount(
+                row_codes, minlength=groups * len(years)).reshape(groups, len(years))
+            facet_counts = [{} for _ in facet_values]
+        counts = {}
+        for field in fields:
+            codes, values = pd.factorize(df[field], sort=True)
+            # Categorical values come out in category order, they are kept
+            # as plain labels so that cubes of different chunks can be merged
+            columns = pd.Index(np.asarray(values), name=field)
+            flat = np.bincount(row_codes * len(values) + codes,
+                               minlength=groups * len(years) * len(values))
+            flat = flat.reshape(groups, len(years), len(values))
+            counts[field] = pd.DataFrame(flat.sum(axis=0), index=year_index, columns=columns)
+            if facet is None or field == facet:
+                continue
+            for position, table in enumerate(flat):
+                # Only the years the facet value has rows in
+                present = facet_year_counts[position] > 0
+                facet_counts[position][field] = pd.DataFrame(
+                    table[present], index=year_index[present], columns=columns)
+        facets = None
+        if facet is not None:
+            facets = {}
+            for position, value in enumerate(np.asarray(facet_values)):
+                present = facet_year_counts[position] > 0
+                facets[value] = cls(pd.Series(facet_year_counts[position][present],
+                                              index=year_index[present]), facet_counts[position])
+        return cls(year_counts, counts, facets)
+
+    @classmethod
+    def load(cls, filepath):
+        data = pd.read_pickle(filepath)
+        # Raises KeyError on cubes saved before the facets were kept
+        facets = dict((value, cls(facet["year_counts"], facet["counts"]))
+                      for value, facet in data["facets"].items())
+        return cls(data["year_counts"], data["counts"], facets)
+
+    def save(self, filepath):
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        pd.to_pickle({"year_counts": self.year_counts,
+                      "counts": self.counts,
+                      "facets": dict((value, {"year_counts": cube.year_counts, "counts": cube.counts})
+                                     for value, cube in self.facets.items())}, filepath)
+
+    def merge(self, other):
+        """Adds up the counts of two cubes, eg: of two parts of the data.
+
+        Returns: A new CountCube object
+        """
+        counts = {}
+        for field in self.fields + [field for field in other.fields if field not in self.counts]:
+            # Cubes built from no rows have no years, leaving them out keeps
+            # the dtypes of the values intact
+            tables = [cube.counts[field] for cube in (self, other)
+                      if field in cube.counts and len(cube.counts[field].index)]
+            if len(tables) == 2:
+                table = tables[0].add(tables[1], fill_value=0).sort_index()
+                # Sorting turns the values into python objects, they are put
+                # back in the dtype build() gives them, eg: uint64 for the
+                # compact integer fields, so that both cubes fingerprint alike
+                columns = pd.Index(sorted(table.columns, key=value_sort_key(field)),
+                                   dtype=tables[0].columns.dtype, name=field)
+                # Values missing from both cubes in a year, eg: of cubes of
+                # different years, are left as NaN by add()
+                counts[field] = table.reindex(columns=columns).fillna(0).astype(np.int64)
+            elif tables:
+                counts[field] = tables[0]
+            else:
+                counts[field] = self.counts.get(field, other.counts.get(field))
+        year_counts = [cube.year_counts for cube in (self, other) if len(cube.year_counts)]
+        if len(year_counts) == 2:
+            year_counts = year_counts[0].add(
+                year_counts[1], fill_value=0).sort_index().astype(np.int64)
+        else:
+            year_counts = year_counts[0] if year_counts else self.year_counts
+        facets = dict(self.facets)
+        for value, cube in other.facets.items():
+            facets[value] = facets[value].merge(cube) if value in facets else cube
+        return CountCube(year_counts, counts, facets)
+
+    @property
+    def fields(self):
+        return list(self.counts)
+
+    def facet(self, value):
+        """Returns: CountCube of the rows of the given facet value"""
+        return self.facets[value]
+
+    @property
+    def years(self):
+        return list(self.year_counts.index)
+
+    def year_totals(self):
+        """Returns: Series of counts per year"""
+        return self.year_counts
+
+    def totals(self, field, years=None):
+        """Counts of each value of field over all (or the given) years.
+
+        Args:
+          field (str): Field name
+          years (list): Years to be considered. Defaults to all years
+
+        Returns: Series of counts indexed by value, values that never occur
+                 in those years are left out
+        """
+        table = self.counts[field]
+        if years is not None:
+            table = table.loc[table.index.isin(years)]
+        totals = table.sum(axis=0)
+        return totals[totals > 0]
+
+    def for_year(self, field, year):
+        """Returns: Series of counts of each value of field in the given year"""
+        # Memoized as the compare charts of many year pairs slice the same years
+        key = (field, year)
+        if key not in self._year_slices:
+            self._year_slices[key] = self.totals(field, years=[year])
+        return self._year_slices[key]
+
+    def compare(self, field, years):
+        """Counts of field in long form for the given years.
+
+        Returns: DataFrame with the columns field, 'year' and COUNT_COLUMN
+                 sorted by value and then year, same as
+                 df.groupby([field, 'year']).size().reset_index()
+        """
+        table = self.counts[field]
+        stacked = table.loc[table.index.isin(years)].T.stack()
+        return stacked[stacked > 0].reset_index(name=COUNT_COLUMN)
+
+    def distribution(self, field, years=None):
+        """Distribution of a whole number field over all (or the given) years,
+        which histograms and quantiles are drawn from.
+
+        Returns: distribution.Distribution object
+        """
+        if years is not None and len(years) == 1:
+            return Distribution.from_counts(self.for_year(field, years[0]))
+        return Distribution.from_counts(self.totals(field, years=years))
@@ -0,0 +1,65 @@
+"""Vectorized derivation of the computed columns used by the charts.
+
+Every derived column is declared once in DERIVED_COLUMNS as a pair of
+(output column names, function). Each function receives the whole frame and
+returns one array-like per output column, computed with column-wise
+pandas/numpy operations only (no per-row Python code). Adding a new derived
+column (eg: time-of-day bucket) only needs a new entry here.
+"""
+import numpy as np
+import pandas as pd
+
+from lib.logger import DEBUG
+import lib.constants as Constants
+
+
+def derive_hour_minutes(df):
+    """Parses the HH:MM 'time' column into hour and minutes integers.
+
+    Only the distinct times, at most 1440 of them, are parsed, and their
+    hour and minutes are mapped back onto the rows through the factorized
+    codes, as validation.py checks the text columns.
+
+    Args:
+      df (pandas.DataFrame): Fatalities data
+
+    Returns: tuple of (hour, minutes) Series
+    """
+    codes, uniques = pd.factorize(df['time'])
+    parsed = pd.to_datetime(pd.Index(uniques).astype(str), format='%H:%M')
+    return (pd.Series(parsed.hour.to_numpy(dtype=np.int64)[codes], index=df.index),
+            pd.Series(parsed.minute.to_numpy(dtype=np.int64)[codes], index=df.index))
+
+
+def derive_road_user(df):
+    """Remaps road users other than Constants.PRIMARY_ROAD_USERS to 'Other'"""
+    road_user = df['road_user']
+    return (road_user.where(road_user.isin(Constants.PRIMARY_ROAD_USERS), 'Other'),)
+
+
+def derive_involvement(df):
+    """True when any of Constants.INVOLVEMENT_COLUMNS is 'yes'"""
+    return ((df[Constants.INVOLVEMENT_COLUMNS] == 'yes').any(axis=1),)
+
+
+DERIVED_COLUMNS = [
+    (('hour', 'minutes'), derive_hour_minutes),
+    (('road_user',), derive_road_user),
+    (('involvement',), derive_involvement),
+]
+
+
+def derive_columns(df):
+    """Populates all the DERIVED_COLUMNS on the given frame.
+
+    Args:
+      df (pandas.DataFrame): Fatalities data
+
+    Returns: A new frame with the derived columns added or replaced
+    """
+    derived = {}
+    for columns, func in DERIVED_COLUMNS:
+        DEBUG("Populating %s column(s)", ", ".join(columns))
+        derived.update(zip(columns, func(df)))
+    return df.assign(**derived)
+
@@ -0,0 +1,83 @@
+"""Distributions of the whole number fields, eg: age and speed_limit.
+
+A distribution is the count of each distinct value of a field over a range
+of years, summed from the per year value counts of the CountCube. Those
+counts are what a sketch of the field would be: they are built in the same
+pass as the rest of the cube and merge across chunks, partitions and
+incremental runs along with it. Because these fields take at most a few
+hundred distinct values, the counts stay small while keeping histograms and
+quantiles exact, which approximate quantile sketches would not.
+"""
+import numpy as np
+
+import lib.constants as Constants
+
+
+class Distribution(object):
+    def __init__(self, values, counts):
+        """
+        Args:
+          values (numpy.ndarray): Distinct values, sorted
+          counts (numpy.ndarray): Count of each value
+        """
+        self.values = np.asarray(values, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+
+    @classmethod
+    def from_counts(cls, counts):
+        """
+        Args:
+          counts (pandas.Series): Counts indexed by value
+
+        Returns: Distribution object
+        """
+        counts = counts[counts > 0].sort_index()
+        return cls(counts.index.to_numpy(), counts.to_numpy())
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def edges(self, step=Constants.STEP_SIZE, top=None):
+        """Edges of the bins of a histogram, starting from 0 and going past
+        top, so that top is in a bin [k * step, (k + 1) * step) like every
+        other value rather than on the upper edge of the last bin.
+
+        Args:
+          step (int): Width of the bins
+          top (int): Value the bins have to reach. Defaults to the highest
+                     value of the distribution
+
+        Returns: numpy array of the edges
+        """
+        if top is None:
+            top = int(self.values.max()) if len(self.values) else 0
+        return np.arange(0, top + 2 * step, step)
+
+    def histogram(self, step=Constants.STEP_SIZE, top=None):
+        """Counts of the values in bins of the given width.
+
+        Values v are counted in the bin [k * step, (k + 1) * step) holding
+        them, same as numpy and matplotlib histograms over edges().
+
+        Returns: (edges, counts) numpy arrays, with one count per bin
+        """
+        edges = self.edges(step, top)
+        counts = np.bincount(self.values // step, weights=self.counts,
+                             minlength=len(edges) - 1)
+        return edges, counts[:len(edges) - 1].astype(np.int64)
+
+    def quantile(self, q):
+        """Smallest value v with at least a fraction q of the counts at
+        or below v, ie: numpy's inverted_cdf quantile of the rows.
+
+        Args:
+          q (float): Fraction between 0 and 1, eg: 0.5 for the median
+
+        Returns: int, None when the distribution is empty
+        """
+        if not self.total:
+            return None
+        cumulative = np.cumsum(self.counts)
+        position = np.searchsorted(cumulative, q * self.total, side="left")
+        return int(self.values[min(position, len(self.values) - 1)])
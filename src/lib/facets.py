@@ -0,0 +1,190 @@
+"""Charts of the rows of each value of a facet field, eg: of each state.
+
+Every facet value gets the same charts, which only differ in the data they
+plot. Rather than drawing each of them from scratch, the figure of a chart
+is drawn once, for the first facet value rendered, and kept for the others,
+whose data only replaces that of its artists in place: the heights of the
+bars, the angles of the pie wedges along with their labels and the points of
+the lines. The axes, ticks and labels are laid out once, which leaves little
+more than saving the image for each further facet value.
+
+The charts of all the facet values share their x values, eg: bins, labels
+and years, which are those of the whole data. This keeps the number of
+artists the same across facet values and the charts comparable.
+"""
+import math
+import re
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from lib.cube import COUNT_COLUMN
+import lib.constants as Constants
+
+
+def slug(value):
+    """File name friendly form of a facet value, eg: new_south_wales"""
+    return re.sub(r"[^a-z0-9]+", "_", str(value).lower()).strip("_")
+
+
+def chart_key(field, value, chart_name):
+    """Build cache key of the chart of a facet value, eg:
+    state/victoria/fatalities_by_age"""
+    return "%s/%s/%s" % (field, slug(value), chart_name)
+
+
+class FacetChart(object):
+    """Figure of a chart, kept for all the facet values"""
+
+    def __init__(self, spec, labels):
+        """
+        Args:
+          spec (registry.ChartSpec): Chart drawn for each facet value
+          labels (list): x values of the chart, its bins for histograms
+        """
+        self.spec = spec
+        self.labels = labels
+        self.fig = None
+        self.ax = None
+
+    @classmethod
+    def create(cls, spec, cube):
+        """Figure of a chart with the x values of the whole data.
+
+        Args:
+          spec (registry.ChartSpec): Chart drawn for each facet value
+          cube (CountCube): Counts of the whole data
+
+        Returns: FacetChart object of the kind of the chart
+        """
+        return KINDS[spec.kind].from_cube(spec, cube)
+
+    @classmethod
+    def from_cube(cls, spec, cube):
+        if spec.field == "year":
+            return cls(spec, list(cube.years))
+        return cls(spec, list(cube.totals(spec.field).index))
+
+    def counts(self, cube):
+        """Counts of each x value in the cube of a facet value.
+
+        Returns: numpy array of the counts
+        """
+        if self.spec.field == "year":
+            totals = cube.year_totals()
+        else:
+            totals = cube.totals(self.spec.field)
+        return totals.reindex(self.labels, fill_value=0).to_numpy()
+
+    def render(self, counts):
+        """Draws the chart with the given counts, or updates the drawn one.
+
+        Returns: (figure, axes) tuple
+        """
+        if self.fig is None:
+            self.fig, self.ax = plt.subplots()
+            self.draw(counts)
+            self._style()
+        else:
+            self.update(counts)
+        return self.fig, self.ax
+
+    def _style(self):
+        # Styled as Loader._generate_chart() styles the charts of the whole data
+        self.ax.tick_params(axis='both', which='major', labelsize=7)
+        self.ax.grid(self.spec.kind != "pie")
+        if self.spec.kind != "pie":
+            self.ax.set_xlabel(self.spec.field.replace("_", " ").title())
+            self.ax.set_ylabel(COUNT_COLUMN)
+
+    def draw(self, counts):
+        raise NotImplementedError
+
+    def update(self, counts):
+        raise NotImplementedError
+
+    def close(self):
+        if self.fig is not None:
+            plt.close(self.fig)
+            self.fig = None
+
+
+class LineChart(FacetChart):
+    def draw(self, counts):
+        self.line, = self.ax.plot(self.labels, counts)
+
+    def update(self, counts):
+        self.line.set_ydata(counts)
+        self.ax.relim()
+        self.ax.autoscale_view()
+
+
+class BarChart(FacetChart):
+    def draw(self, counts):
+        self.bars = self.ax.bar(self.labels, counts)
+
+    def update(self, counts):
+        for bar, count in zip(self.bars, counts):
+            bar.set_height(count)
+        # The bars are autoscaled with a 5% margin at the top
+        self.ax.set_ylim(0, max(counts.max(), 1) * 1.05)
+
+
+class HistogramChart(BarChart):
+    """Histogram, with the bins of Constants.STEP_SIZE of the whole data"""
+
+    def __init__(self, spec, labels, top=0):
+        """
+        Args:
+          top (int): Highest value of the field in the whole data
+        """
+        super(HistogramChart, self).__init__(spec, labels)
+        self.top = top
+
+    @classmethod
+    def from_cube(cls, spec, cube):
+        distribution = cube.distribution(spec.field)
+        top = int(distribution.values.max()) if distribution.total else 0
+        return cls(spec, distribution.edges(Constants.STEP_SIZE, top), top)
+
+    def counts(self, cube):
+        return cube.distribution(self.spec.field).histogram(Constants.STEP_SIZE, top=self.top)[1]
+
+    def draw(self, counts):
+        _, _, self.bars = self.ax.hist(self.labels[:-1], self.labels, weights=counts)
+
+
+class PieChart(FacetChart):
+    """Pie chart, with labels and percentages as drawn by Axes.pie()"""
+    LABEL_DISTANCE = 1.1
+    PCT_DISTANCE = 0.6
+    AUTOPCT = '%1.1f%%'
+
+    def draw(self, counts):
+        # Drawn with all the labels, those of the values a facet value has
+        # no rows of are hidden
+        self.wedges, self.texts, self.autotexts = self.ax.pie(
+            np.ones(len(self.labels)), labels=self.labels, autopct=self.AUTOPCT,
+            textprops={"fontsize": 7})
+        self.update(counts)
+
+    def update(self, counts):
+        total = counts.sum()
+        theta1 = 0.0
+        for wedge, text, autotext, count in zip(self.wedges, self.texts, self.autotexts, counts):
+            frac = count / total if total else 0.0
+            theta2 = theta1 + frac
+            for artist in (wedge, text, autotext):
+                artist.set_visible(bool(count))
+            wedge.set_theta1(360. * theta1)
+            wedge.set_theta2(360. * theta2)
+            thetam = math.pi * (theta1 + theta2)
+            x, y = math.cos(thetam), math.sin(thetam)
+            text.set_position((self.LABEL_DISTANCE * x, self.LABEL_DISTANCE * y))
+            text.set_horizontalalignment('left' if x > 0 else 'right')
+            autotext.set_position((self.PCT_DISTANCE * x, self.PCT_DISTANCE * y))
+            autotext.set_text(self.AUTOPCT % (100. * frac))
+            theta1 = theta2
+
+
+KINDS = {"line": LineChart, "bar": BarChart, "pie": PieChart, "histogram": HistogramChart}
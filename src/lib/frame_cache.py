@@ -0,0 +1,177 @@
+"""On disk binary columnar cache of the processed fatalities data.
+
+Parsing the csv file and processing it is the bulk of the start up cost, so
+the processed frame is stored as one .npy file per column: numeric columns
+as is and text columns as integer codes into a dictionary of categories kept
+in the metadata. Columns are loaded back with memory mapping. The rows
+rejected by the validation are kept along with the frame, so that a frame
+loaded from the cache quarantines them as processing it would have.
+
+The cache is keyed by the size, modification time and sha256 of each source
+file along with a digest of the processing code, so it is only used while
+it reflects the current source files and processing. A frame read from
+several partition files is cached under the set of files it was read from.
+"""
+import hashlib
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from lib.logger import DEBUG, INFO
+import lib.utils as Utils
+
+FORMAT_VERSION = 3
+META_FILE = "meta.json"
+REJECTS_FILE = "rejects.csv"
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_digest(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as fh:
+        for block in iter(lambda: fh.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FrameCache(object):
+    def __init__(self, source_paths, cache_dir, processing_digest):
+        """
+        Args:
+          source_paths (list): Paths of the csv files the frame is built from
+          cache_dir (str): Directory under which the cache is kept
+          processing_digest (str): Digest of the code that processed the frame
+        """
+        self.source_paths = [os.path.abspath(path) for path in source_paths]
+        key = "%s-%s" % (os.path.basename(self.source_paths[0]) if len(self.source_paths) == 1
+                         else "partitions",
+                         hashlib.sha256("\n".join(self.source_paths).encode()).hexdigest()[:12])
+        self.path = os.path.join(cache_dir, key)
+        self.processing_digest = processing_digest
+        self.meta = None
+
+    @staticmethod
+    def _source_stat(source_path):
+        stat = os.stat(source_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _is_source_valid(self, source):
+        size, mtime_ns = self._source_stat(source["path"])
+        if source["size"] != size:
+            return False
+        if source["mtime_ns"] == mtime_ns:
+            return True
+        # A touched but otherwise unchanged file is still served from the
+        # cache, its content hash is only computed when the mtime differs
+        if source["sha256"] != file_digest(source["path"]):
+            return False
+        source["mtime_ns"] = mtime_ns
+        return True
+
+    def _is_valid(self, meta):
+        if not meta or meta.get("format_version") != FORMAT_VERSION:
+            return False
+        if meta.get("processing_digest") != self.processing_digest:
+            return False
+        if [source["path"] for source in meta["sources"]] != self.source_paths:
+            return False
+        mtimes = [source["mtime_ns"] for source in meta["sources"]]
+        try:
+            if not all(self._is_source_valid(source) for source in meta["sources"]):
+                return False
+        except OSError:
+            return False
+        if mtimes != [source["mtime_ns"] for source in meta["sources"]]:
+            Utils.write_to_file(os.path.join(self.path, META_FILE), Utils.to_json(meta))
+        return True
+
+    def load(self):
+        """Loads the cached frame.
+
+        Returns: DataFrame, or None when there is no valid cache
+        """
+        meta = Utils.read_json(os.path.join(self.path, META_FILE))
+        if not self._is_valid(meta):
+            DEBUG("No valid frame cache at %s", self.path)
+            return None
+        columns = {}
+        for column in meta["columns"]:
+            values = np.load(os.path.join(self.path, column["file"]), mmap_mode='r')
+            if "categories" in column:
+                values = pd.Categorical.from_codes(values, categories=column["categories"],
+                                                   ordered=column["ordered"])
+                if not column["categorical"]:
+                    values = np.asarray(values, dtype=object)
+            columns[column["name"]] = values
+        self.meta = meta
+        INFO("Loaded processed data from the frame cache %s", self.path)
+        # Without copy=False the columns are consolidated into new blocks,
+        # copying them all out of the memory maps
+        return pd.DataFrame(columns, index=pd.RangeIndex(meta["rows"]), copy=False)
+
+    def rejects(self):
+        """Rows rejected when the loaded frame was processed.
+
+        Returns: (csv file of the rows or None, number of rows, map of reason
+                 code to its number of rows) tuple, see Quarantine.restore()
+        """
+        rejects = self.meta["rejects"]
+        rows_path = os.path.join(self.path, REJECTS_FILE) if rejects["rows"] else None
+        return rows_path, rejects["rows"], rejects["counts"]
+
+    def store(self, df, rejected_rows=None, reject_counts=None):
+        """Stores the frame, replacing any earlier cache of the source files.
+
+        Args:
+          df (pandas.DataFrame): Processed frame
+          rejected_rows (pandas.DataFrame): Rows quarantined while processing
+                                            it, see Quarantine.kept_rows()
+          reject_counts (dict): Map of each reason code to its number of rows
+        """
+        sources = []
+        for source_path in self.source_paths:
+            size, mtime_ns = self._source_stat(source_path)
+            sources.append({"path": source_path, "size": size, "mtime_ns": mtime_ns,
+                            "sha256": file_digest(source_path)})
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "processing_digest": self.processing_digest,
+            "sources": sources,
+            "rows": len(df),
+            "columns": [],
+            "rejects": {"rows": 0 if rejected_rows is None else len(rejected_rows),
+                        "counts": reject_counts or {}}
+        }
+        # Unique to the process, as the shards of a build may store the
+        # same frame at the same time
+        tmp_path = "%s.%s.tmp" % (self.path, uuid.uuid4().hex)
+        os.makedirs(tmp_path)
+        if rejected_rows is not None:
+            rejected_rows.to_csv(os.path.join(tmp_path, REJECTS_FILE), index=False)
+        for position, name in enumerate(df.columns):
+            series = df[name]
+            column = {"name": name, "file": "%03d.npy" % position}
+            if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object:
+                categorical = series.astype("category")
+                column["categorical"] = isinstance(series.dtype, pd.CategoricalDtype)
+                column["ordered"] = bool(categorical.cat.ordered)
+                column["categories"] = [Utils.to_builtin(value)
+                                        for value in categorical.cat.categories]
+                values = categorical.cat.codes.values
+            else:
+                values = series.values
+            np.save(os.path.join(tmp_path, column["file"]), values)
+            meta["columns"].append(column)
+        Utils.write_to_file(os.path.join(tmp_path, META_FILE), Utils.to_json(meta))
+        shutil.rmtree(self.path, ignore_errors=True)
+        try:
+            os.rename(tmp_path, self.path)
+        except OSError:
+            # Stored by another process in the meantime
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            DEBUG("The frame cache %s was stored by another process", self.path)
+            return
+        DEBUG("Stored processed data in the frame cache %s", self.path)
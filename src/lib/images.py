@@ -0,0 +1,105 @@
+"""Image output of the charts.
+
+A chart can be saved in any of FORMATS, at several DPIs for the pages to
+offer as a srcset, and under file names carrying a hash of their content so
+that they can be cached forever. The tight bounding box of the figure is
+computed once and shared by all the variants, rather than bbox_inches='tight'
+laying the figure out again on every savefig().
+"""
+import hashlib
+import io
+import os
+from collections import namedtuple
+
+import matplotlib
+
+import lib.utils as Utils
+
+FORMATS = ("jpg", "png", "webp", "svg")
+HASH_LENGTH = 12
+
+ImageSettings = namedtuple("ImageSettings", ["format", "dpis", "hashed"])
+ImageSettings.__new__.__defaults__ = ("jpg", (), False)
+
+
+def variant_names(key, settings):
+    """File names, relative to the charts directory, of the variants of a
+    chart saved without hashed file names.
+
+    Returns: List of (dpi, file name) tuples, dpi is None for the default
+    """
+    # Vector images look the same at any DPI
+    dpis = list(settings.dpis) if settings.format != "svg" else []
+    if len(dpis) < 2:
+        return [(dpis[0] if dpis else None, "%s.%s" % (key, settings.format))]
+    return [(dpi, "%s-%ddpi.%s" % (key, dpi, settings.format)) for dpi in dpis]
+
+
+def save_figure(fig, charts_dir, key, settings):
+    """Saves the variants of a chart.
+
+    Args:
+      fig (matplotlib.figure.Figure): Figure of the chart
+      charts_dir (str): Directory the charts are saved under
+      key (str): Chart key, its path relative to charts_dir sans extension
+      settings (ImageSettings): Format, DPIs and file naming of the images
+
+    Returns: List of dicts with the file (relative to charts_dir), dpi and
+             pixel width of each variant
+    """
+    bbox = fig.get_tightbbox(fig.canvas.get_renderer()).padded(
+        matplotlib.rcParams["savefig.pad_inches"])
+    variants = []
+    for dpi, name in variant_names(key, settings):
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=settings.format, dpi=dpi, bbox_inches=bbox)
+        content = buffer.getvalue()
+        if settings.hashed:
+            stem, extension = os.path.splitext(name)
+            name = "%s.%s%s" % (stem, hashlib.sha256(content).hexdigest()[:HASH_LENGTH], extension)
+        filepath = os.path.join(charts_dir, name)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, "wb") as fh:
+            fh.write(content)
+        variants.append({"file": name, "dpi": dpi,
+                         "width": int(bbox.width * (dpi or fig.dpi))})
+    return variants
+
+
+def default_variants(key, settings):
+    """Variants expected of a chart that is not in the build manifest"""
+    return [{"file": name, "dpi": dpi, "width": None} for dpi, name in variant_names(key, settings)]
+
+
+def remove_stale(charts_dir, old_variants, new_variants):
+    """Deletes the files of old_variants that are not among new_variants"""
+    kept = set(variant["file"] for variant in new_variants)
+    for variant in old_variants or ():
+        filepath = os.path.join(charts_dir, variant["file"])
+        if variant["file"] not in kept and Utils.file_exists(filepath):
+            os.remove(filepath)
+
+
+def img_attributes(variants, url_prefix, sizes):
+    """Builds the src, srcset and sizes attributes of the img tag of a chart.
+
+    Args:
+      variants (list): Variants of the chart as returned by save_figure()
+      url_prefix (str): Url of the charts directory relative to the page
+      sizes (str): Width the image is displayed at, eg: 50vw
+
+    Returns: The attributes as a string, only src for single variant charts
+    """
+    variants = sorted(variants, key=lambda variant: variant["dpi"] or 0)
+    attributes = 'src="%s%s"' % (url_prefix, variants[0]["file"])
+    if len(variants) < 2:
+        return attributes
+    if all(variant["width"] for variant in variants):
+        candidates = ["%s%s %dw" % (url_prefix, variant["file"], variant["width"])
+                      for variant in variants]
+    else:
+        # Widths are only known once rendered, fall back to pixel densities
+        candidates = ["%s%s %gx" % (url_prefix, variant["file"],
+                                    float(variant["dpi"]) / variants[0]["dpi"])
+                      for variant in variants]
+    return '%s srcset="%s" sizes="%s"' % (attributes, ", ".join(candidates), sizes)
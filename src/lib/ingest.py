@@ -0,0 +1,124 @@
+"""Append aware incremental ingestion of the fatalities data file.
+
+The data file only ever grows by appending rows. After a run, the byte offset
+and number of rows consumed are recorded along with hashes of the header and
+of the last consumed line, and the count cube built so far is persisted next
+to it. A later run then only parses the rows appended after that offset and
+merges their counts into the persisted cube. When the header or the last
+consumed line no longer match, the file was rewritten rather than appended
+to and everything is ingested again.
+
+Rows are located by newlines, so quoted values spanning lines are not
+supported in this mode.
+"""
+import hashlib
+import io
+import os
+import pickle
+
+import pandas as pd
+
+from lib.cube import CountCube
+from lib.logger import DEBUG, INFO
+import lib.utils as Utils
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class IncrementalIngestor(object):
+    def __init__(self, data_file_path, state_dir):
+        """
+        Args:
+          data_file_path (str): Absolute path of the csv data file
+          state_dir (str): Directory where the ingestion state is persisted
+        """
+        self.data_file_path = data_file_path
+        # Keyed by path so that different data files do not share state
+        key = "%s-%s" % (os.path.basename(data_file_path),
+                         _digest(os.path.abspath(data_file_path).encode())[:12])
+        self.state_path = os.path.join(state_dir, key + ".json")
+        self.cube_path = os.path.join(state_dir, key + ".cube.pkl")
+        self.previous_cube = None
+        self.pending_state = None
+        # Last saved cube and state, which long lived processes reuse
+        # instead of loading the cube again
+        self.saved_cube = None
+        self.saved_state = None
+
+    def _is_appended(self, fh, header, state):
+        """Whether the file still starts with the content ingested earlier"""
+        if state.get("header_hash") != _digest(header):
+            return False
+        if os.fstat(fh.fileno()).st_size < state["offset"]:
+            return False
+        fh.seek(state["offset"] - state["last_line_length"])
+        return _digest(fh.read(state["last_line_length"])) == state["last_line_hash"]
+
+    def _load_cube(self, state):
+        if self.saved_cube is not None and state == self.saved_state:
+            return self.saved_cube
+        try:
+            return CountCube.load(self.cube_path)
+        except (IOError, OSError, EOFError, KeyError, pickle.UnpicklingError):
+            DEBUG("Could not load the persisted counts %s", self.cube_path)
+            return None
+
+    def read_new_rows(self):
+        """Reads the rows that were not ingested by an earlier run.
+
+        Returns: DataFrame of the new rows, all the rows on a full rebuild
+        """
+        state = Utils.read_json(self.state_path)
+        with open(self.data_file_path, 'rb') as fh:
+            header = fh.readline()
+            self.previous_cube = None
+            if state and self._is_appended(fh, header, state):
+                self.previous_cube = self._load_cube(state)
+            if self.previous_cube is not None:
+                start, rows = state["offset"], state["rows"]
+                INFO("Reading rows appended to %s after the %d rows already ingested",
+                     self.data_file_path, rows)
+            else:
+                start, rows = len(header), 0
+                INFO("No valid ingestion state for %s, ingesting all of it",
+                     self.data_file_path)
+            fh.seek(start)
+            data = fh.read()
+        # Only complete lines are consumed, a partially written last line
+        # gets picked up by the next run
+        data = data[:data.rfind(b"\n") + 1]
+        # The header is parsed along with the new rows so that they are
+        # read exactly as a full read of the file would
+        df = pd.read_csv(io.BytesIO(header + data))
+        last_line = data[data.rfind(b"\n", 0, len(data) - 1) + 1:] if data else None
+        DEBUG("Read %d new rows", len(df))
+        if last_line is None and state and self.previous_cube is not None:
+            self.pending_state = dict(state)
+        else:
+            last_line = last_line if last_line is not None else header
+            self.pending_state = {
+                "offset": start + len(data),
+                "rows": rows + len(df),
+                "header_hash": _digest(header),
+                "last_line_hash": _digest(last_line),
+                "last_line_length": len(last_line)
+            }
+        return df
+
+    def accumulate(self, cube):
+        """Merges the cube built from the new rows into the persisted one.
+
+        Args:
+          cube (CountCube): Counts of the rows returned by read_new_rows()
+
+        Returns: CountCube object covering all the rows ingested so far
+        """
+        if self.previous_cube is not None:
+            cube = self.previous_cube.merge(cube)
+        cube.save(self.cube_path)
+        Utils.write_to_file(self.state_path, Utils.to_json(self.pending_state))
+        DEBUG("Saved ingestion state %s", self.pending_state)
+        self.saved_cube, self.saved_state = cube, self.pending_state
+        return cube
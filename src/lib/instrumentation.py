@@ -0,0 +1,164 @@
+"""Per stage timing and memory instrumentation of a website generator run.
+
+Each stage records its wall and CPU time, the growth of the peak resident
+memory of the process, the rows it read and produced and the bytes of the
+files it wrote. Stages can also be profiled with cProfile, one dump per
+stage. When instrumentation is disabled stage() hands out a shared no-op
+stage, so instrumented code costs next to nothing.
+"""
+import cProfile
+import os
+import re
+import resource
+import sys
+import time
+
+from lib.logger import INFO
+import lib.utils as Utils
+
+REPORT_VERSION = 1
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024.0 * 1024 if sys.platform == "darwin" else 1024.0)
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **counters):
+        pass
+
+    def add_output(self, filepath):
+        pass
+
+
+NULL_STAGE = _NullStage()
+
+
+class Stage(object):
+    def __init__(self, run, name, counters):
+        self.run = run
+        self.record = {"name": name, "pid": os.getpid()}
+        self.record.update(counters)
+        self.outputs = {}
+        self.profiler = None
+
+    def set(self, **counters):
+        """Records counters such as rows_in and rows_out of the stage"""
+        self.record.update(counters)
+
+    def add_output(self, filepath):
+        """Records a file written by the stage along with its size"""
+        self.outputs[os.path.relpath(filepath, self.run.base_dir)] = os.path.getsize(filepath)
+
+    def __enter__(self):
+        if self.run.profile_dir and self.run.active_profiler is None:
+            # cProfile does not nest, stages within a profiled stage are
+            # accounted to the outer one
+            self.profiler = self.run.active_profiler = cProfile.Profile()
+        self.rss = peak_rss_mb()
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler is not None:
+            self.profiler.disable()
+        wall = time.perf_counter() - self.wall
+        self.record.update({
+            "wall_seconds": round(wall, 6),
+            "cpu_seconds": round(time.process_time() - self.cpu, 6),
+            "peak_rss_delta_mb": round(peak_rss_mb() - self.rss, 1),
+            "bytes_written": sum(self.outputs.values()),
+            "outputs": self.outputs
+        })
+        if exc_info[0] is not None:
+            self.record["error"] = exc_info[0].__name__
+        if self.profiler is not None:
+            self.run.active_profiler = None
+            self.record["profile"] = self.run.dump_profile(self.record["name"], self.profiler)
+        self.run.stages.append(self.record)
+        INFO("Stage %s took %.3fs", self.record["name"], wall)
+        return False
+
+
+class Run(object):
+    def __init__(self, enabled=False, profile_dir=None, base_dir=None):
+        """
+        Args:
+          enabled (bool): Record the stages of the run
+          profile_dir (str): Directory to dump a cProfile file of each
+                             stage in. Implies enabled
+          base_dir (str): Directory the paths of the outputs are reported
+                          relative to. Defaults to the current directory
+        """
+        self.profile_dir = profile_dir
+        self.enabled = enabled or bool(profile_dir)
+        self.base_dir = base_dir or os.getcwd()
+        self.stages = []
+        self.active_profiler = None
+        self.started = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def stage(self, name, **counters):
+        """Context manager instrumenting the code run within it as a stage.
+
+        Args:
+          name (str): Stage name, eg: process_data or chart:fatalities_by_year
+          counters: Initial counters of the stage, eg: rows_in=100
+
+        Returns: Stage, which can record further counters and outputs
+        """
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name, counters)
+
+    def dump_profile(self, name, profiler):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        filepath = os.path.join(self.profile_dir, "%s.prof" % re.sub(r"[^\w.-]", "_", name))
+        profiler.dump_stats(filepath)
+        return filepath
+
+    def take_stages(self):
+        """Returns: The stages recorded so far, which are then forgotten"""
+        stages, self.stages = self.stages, []
+        return stages
+
+    def add_stages(self, stages):
+        """Adds the stages recorded by another process, eg: a chart worker"""
+        self.stages.extend(stages)
+
+    def report(self, **details):
+        """Builds the run report.
+
+        Args:
+          details: Details of the run to include, eg: the arguments
+
+        Returns: dict of the run report
+        """
+        report = {
+            "report_version": REPORT_VERSION,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "pid": os.getpid(),
+            "wall_seconds": round(time.perf_counter() - self.wall, 6),
+            "cpu_seconds": round(time.process_time() - self.cpu, 6),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "bytes_written": sum(stage["bytes_written"] for stage in self.stages),
+            "stages": self.stages
+        }
+        report.update(details)
+        return report
+
+    def write_report(self, filepath, **details):
+        Utils.write_to_file(filepath, Utils.to_json(self.report(**details)))
+        INFO("Wrote the run report to %s", filepath)
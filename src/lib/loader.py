@@ -1,87 +1,642 @@
+import inspect
+import json
+import itertools
 import os
-import re
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import matplotlib
+# Charts are only ever saved to files, so force the non-interactive
+# backend irrespective of the environment's default
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
 import pandas as pd
 import numpy as np
 import seaborn as sns
-from jinja2 import Environment
 # import mpld3
 
+import lib.logger as logger
 from lib.logger import DEBUG, INFO
+from lib.build_cache import BuildCache
+from lib.cube import CountCube
+import lib.derived as derived
+from lib.derived import derive_columns
+import lib.distribution as distribution
+from lib.facets import FacetChart
+import lib.facets as facets
+from lib.frame_cache import FrameCache
+import lib.images as images
+from lib.images import ImageSettings
+from lib.ingest import IncrementalIngestor
+from lib.partitions import DataSource
+from lib.instrumentation import NULL_STAGE, Run
+import lib.payload as payload
+import lib.registry as registry
+from lib.registry import chart
+import lib.schema as schema
+from lib.shards import ShardPlan
+import lib.shards as shards
+import lib.templates as templates
+import lib.validation as validation
 import lib.constants as Constants
 import lib.utils as Utils
 
-# TODOS:
-# 1. If different data file is specified, then download data option in HTML should
-#    download that file. Currently it always downloads traffic.csv
-# 2. logger module can be extended with more features like logging to file as well as console, etc.,
+
+class ArgumentError(ValueError):
+    """An argument does not fit the loaded data"""
 
 
 class Loader(object):
     def __init__(self, parsed_args):
         self.parsed_args = parsed_args
         relative_data_file = parsed_args.data_file or Constants.DEFAULT_DATA_FILE
-        INFO("Data file: %s" % relative_data_file)
+        INFO("Data file: %s", relative_data_file)
         self.project_dir = Utils.get_project_dir()
+        # Directory the static site is generated under
+        self.output_dir = os.path.abspath(
+            getattr(parsed_args, "output_dir", None) or self.project_dir)
         self.charts_dir = os.path.join(
-            self.project_dir, Constants.RELATIVE_CHARTS_DIR)
-        self.data_file_path = os.path.join(
-            self.project_dir, relative_data_file)
-        self.fatalities_df = pd.read_csv(self.data_file_path)
-        min_yr = self.fatalities_df["year"].min()
-        max_yr = self.fatalities_df["year"].max()
-        self.start_year = parsed_args.compare_start_year or min_yr
-        self.end_year = parsed_args.compare_end_year or max_yr
-        DEBUG("Compare statistics will be generated between years %s and %s" %
-              (self.start_year, self.end_year))
-        assert min_yr <= self.start_year
-        assert max_yr >= self.end_year
-        self.jinja_env = Environment()
+            self.output_dir, Constants.RELATIVE_CHARTS_DIR)
+        os.makedirs(self.charts_dir, exist_ok=True)
+        # A csv file, or a directory or glob pattern of partition files
+        self.data_source = DataSource.resolve(os.path.join(self.project_dir, relative_data_file))
+        self.data_file_path = (self.data_source.files[0] if self.data_source.is_single_file
+                               else self.data_source.path)
+        self.compare_all = getattr(parsed_args, "compare_all", False)
+        self.compare_baseline = getattr(parsed_args, "compare_baseline", None)
+        self.compare_batch_size = getattr(parsed_args, "compare_batch_size", None) or 10
+        self.charts = registry.select(charts=getattr(parsed_args, "charts", None),
+                                      groups=getattr(parsed_args, "group", None))
+        # Charts drawn again from the rows of each state on the state pages
+        self.state_charts = [spec for spec in self.charts if not spec.compare and
+                             spec.field != Constants.FACET_FIELD] if getattr(
+                                 parsed_args, "state_pages", False) else []
+        self.data_files = self.data_source.select(self.get_needed_years())
+        self.ingestor = None
+        # Watch mode only ingests the rows appended since the last change
+        if getattr(parsed_args, "incremental", False) or getattr(parsed_args, "watch", False):
+            self.ingestor = IncrementalIngestor(self.data_file_path, os.path.join(
+                self.project_dir, Constants.RELATIVE_CACHE_DIR, "ingest"))
+        self.chunk_size = getattr(parsed_args, "chunk_size", None)
+        self.frame_cache = None
+        if self.ingestor is None and not self.chunk_size:
+            self.frame_cache = FrameCache(self.data_files, os.path.join(
+                self.project_dir, Constants.RELATIVE_CACHE_DIR, "frames"), self.get_processing_digest())
+        # Shard of the build generated by this run, all of it when None
+        self.shard = getattr(parsed_args, "shard", None)
+        self.shard_plan = None
+        self.compare_pairs = []
+        quarantine_file = os.path.join(
+            self.output_dir, getattr(parsed_args, "quarantine_file", None) or Constants.RELATIVE_QUARANTINE_FILE)
+        # The shards of a build reject the same rows, the first one writes them out
+        if self.shard is not None and self.shard.index != 1:
+            quarantine_file = None
+        self.quarantine = validation.Quarantine(quarantine_file)
+        self.rebuild_cache = getattr(parsed_args, "rebuild_cache", False)
+        self.memory_report = getattr(parsed_args, "memory_report", False)
+        self.data_processed = False
+        self.report_file = getattr(parsed_args, "report", None)
+        self.start_instrumentation()
+        self.current_stage = NULL_STAGE
+        self._load_data_stage()
+        self.start_year = None
+        self.end_year = None
+        self.jobs = getattr(parsed_args, "jobs", None) or 1
+        self.reuse_figure = getattr(parsed_args, "reuse_figure", False)
+        # jpg renders the charts as images, json writes their data for
+        # lib/assets/charts.js to draw in the browser
+        self.output_format = getattr(parsed_args, "output_format", None) or "jpg"
+        self.image_settings = ImageSettings(format=getattr(parsed_args, "image_format", None) or "jpg",
+                                            dpis=tuple(getattr(parsed_args, "dpi", None) or ()),
+                                            hashed=getattr(parsed_args, "hashed_filenames", False))
+        self.current_chart = None
+        self.current_pair = None
+        self._figure = None
+        self.cube = None
+        self.build_cache = BuildCache(os.path.join(self.output_dir, Constants.RELATIVE_CHARTS_MANIFEST),
+                                      force=getattr(parsed_args, "force", False))
+        self.chart_fingerprints = {}
+        # Image variants of each chart, see images.save_figure()
+        self.chart_outputs = {}
+        # Any change to the charting code, the counts it draws from or the
+        # libraries invalidates every chart
+        self.renderer_digest = BuildCache.fingerprint(
+            Utils.read_file(__file__), Utils.read_file(facets.__file__), Utils.read_file(images.__file__),
+            Utils.read_file(distribution.__file__), Utils.read_file(inspect.getsourcefile(CountCube)),
+            matplotlib.__version__, sns.__version__)
+        self.jinja_env = self.create_jinja_env()
+        self.apply_style()
+
+    def __getstate__(self):
+        # Loader is shipped to chart worker processes, which have no use
+        # for the jinja environment. The charts are drawn from the cube, so
+        # the processed frame is left out rather than pickled for each worker
+        state = self.__dict__.copy()
+        del state["jinja_env"]
+        state["fatalities_df"] = None
+        state["_figure"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.jinja_env = self.create_jinja_env()
+
+    def create_jinja_env(self):
+        return templates.create_environment(os.path.join(
+            self.project_dir, Constants.RELATIVE_CACHE_DIR, "templates"))
+
+    @staticmethod
+    def apply_style():
         sns.set()
-        sns.set_context("notebook", font_scale=1.5,
-                        rc={"lines.linewidth": 2.5})
+        sns.set_context(Constants.CHART_STYLE["context"],
+                        font_scale=Constants.CHART_STYLE["font_scale"],
+                        rc=Constants.CHART_STYLE["rc"])
+
+    def start_instrumentation(self):
+        self.instrumentation = Run(enabled=bool(self.report_file),
+                                   profile_dir=getattr(self.parsed_args, "profile", None),
+                                   base_dir=self.output_dir)
+
+    def _load_data_stage(self):
+        with self._stage("load_data") as stage:
+            self.load_data()
+            if self.fatalities_df is not None:
+                stage.set(rows_out=len(self.fatalities_df), from_cache=self.data_processed)
+
+    def refresh(self):
+        """Reads the data file again and regenerates the charts and pages
+        whose inputs changed, as a later run would"""
+        self.start_instrumentation()
+        self.data_processed = False
+        self._load_data_stage()
+        self.run()
+
+    @contextmanager
+    def _stage(self, name, **counters):
+        # Outputs written by the methods run within the stage, eg: charts
+        # and pages, are recorded on the current stage
+        with self.instrumentation.stage(name, **counters) as stage:
+            self.current_stage = stage
+            try:
+                yield stage
+            finally:
+                self.current_stage = NULL_STAGE
 
     def run(self):
-        INFO("Processing input data")
-        self.process_data()
+        if self.chunk_size:
+            with self._stage("stream_data") as stage:
+                self.stream_data()
+                stage.set(rows_in=self.streamed_rows,
+                          rows_out=int(self.cube.year_totals().sum()),
+                          rows_rejected=self.quarantine.rows, rejects=dict(self.quarantine.counts))
+        else:
+            self.ensure_processed()
+            self._build_cube_stage()
+        self.set_compare_years()
+        compare_pairs = self.compare_pairs = self.get_compare_pairs()
         INFO("Updating all charts")
-        for method in Utils.get_all_method_names(self):
-            if method.startswith("chart_"):
-                getattr(self, method)()
+        batches = self.get_render_batches(compare_pairs)
+        if self.shard is not None:
+            self.shard_plan = ShardPlan(self.shard, self.get_shard_units(batches, compare_pairs))
+            batches = [batch for batch in ([item for item in batch if self.shard_plan.owns(
+                shards.chart_unit(self._chart_key(*item)))] for batch in batches) if batch]
+        self.render_charts(batches)
+        if self.state_charts:
+            with self._stage("render_state_charts") as stage:
+                self.render_state_charts()
+                stage.set(states=len(self.get_states()), charts=len(self.state_charts))
+        self.build_cache.update(self.chart_fingerprints, self.chart_outputs)
+        # The charts manifest of a sharded build is written by the merge
+        if self.shard_plan is None:
+            self.build_cache.save()
         INFO("Completed generating static files for the website")
-        self.generate_html_pages()
-        self.generate_index_html()
+        with self._stage("generate_html_pages"):
+            self.generate_html_pages()
+        if self.shard_plan is None:
+            with self._stage("generate_index_html"):
+                self.generate_index_html()
+        if compare_pairs:
+            with self._stage("generate_compare_pages"):
+                self.generate_compare_pages(compare_pairs)
+        if self.state_charts:
+            with self._stage("generate_state_pages"):
+                self.generate_state_pages()
         INFO("Completed generating html pages")
+        if self.shard_plan is not None:
+            self.write_shard_manifest()
+        if self.report_file:
+            self.instrumentation.write_report(
+                self.report_file, data_file=self.data_file_path,
+                arguments=dict((name, Utils.to_builtin(value))
+                               for name, value in vars(self.parsed_args).items()))
+
+    def ensure_processed(self):
+        """Processes the loaded data unless it came processed from the frame
+        cache, storing it in the frame cache"""
+        if self.data_processed:
+            INFO("Input data is already processed")
+            return
+        INFO("Processing input data")
+        with self._stage("process_data", rows_in=len(self.fatalities_df)) as stage:
+            self.process_data()
+            stage.set(rows_out=len(self.fatalities_df), rows_rejected=self.quarantine.rows,
+                      rejects=dict(self.quarantine.counts))
+        if self.frame_cache is not None:
+            with self._stage("store_frame_cache"):
+                self.frame_cache.store(self.fatalities_df, self.quarantine.kept_rows(),
+                                       self.quarantine.counts)
+        self.data_processed = True
+
+    def _build_cube_stage(self):
+        with self._stage("build_cube", rows_in=len(self.fatalities_df)) as stage:
+            self.build_cube()
+            # Incremental runs also count the rows of the earlier runs
+            stage.set(rows_out=int(self.cube.year_totals().sum()))
+
+    def load_data(self):
+        if self.chunk_size:
+            # Read chunk by chunk in stream_data()
+            self.fatalities_df = None
+            return
+        if self.ingestor is not None:
+            self.fatalities_df = self.ingestor.read_new_rows()
+            return
+        # The memory report compares the frame before and after compaction,
+        # which needs the data to be processed again
+        if not self.rebuild_cache and not self.memory_report:
+            self.fatalities_df = self.frame_cache.load()
+            if self.fatalities_df is not None:
+                self.data_processed = True
+                self.quarantine.restore(*self.frame_cache.rejects())
+                self.quarantine.finish()
+                return
+        self.fatalities_df = DataSource.read(self.data_files)
+
+    def get_needed_years(self):
+        """Years of the data the selected charts are drawn from.
+
+        Returns: List of years, None when all of them are needed
+        """
+        if self.compare_all or self.compare_baseline is not None:
+            return None
+        if any(not spec.compare for spec in self.charts):
+            return None
+        years = self.data_source.years()
+        start = getattr(self.parsed_args, "compare_start_year", None)
+        end = getattr(self.parsed_args, "compare_end_year", None)
+        # The compare years default to the first and last years, which are
+        # only known up front when every file is the partition of a year
+        if years is None and (start is None or end is None):
+            return None
+        return [start or min(years), end or max(years)]
+
+    def get_processing_digest(self):
+        # The cached frame is only valid for the code that processed it
+        return BuildCache.fingerprint(Utils.read_file(derived.__file__), Utils.read_file(schema.__file__),
+                                      Utils.read_file(validation.__file__), Utils.read_file(Constants.__file__),
+                                      inspect.getsource(Loader.process_frame), pd.__version__)
+
+    def set_compare_years(self):
+        min_yr = min(self.cube.years)
+        max_yr = max(self.cube.years)
+        self.start_year = self.parsed_args.compare_start_year or min_yr
+        self.end_year = self.parsed_args.compare_end_year or max_yr
+        DEBUG("Compare statistics will be generated between years %s and %s",
+              self.start_year, self.end_year)
+        assert min_yr <= self.start_year
+        assert max_yr >= self.end_year
+
+    def get_compare_pairs(self):
+        """Year pairs the compare charts are rendered for on top of the
+        compare start and end years.
+
+        Returns: List of (start year, end year) tuples, for every pair of
+                 years with compare_all, for every year and the baseline
+                 with compare_baseline and none otherwise
+
+        Raises: ArgumentError when the baseline year is not in the data
+        """
+        years = sorted(int(year) for year in self.cube.years)
+        if self.compare_baseline is not None:
+            if self.compare_baseline not in years:
+                raise ArgumentError("argument --compare-baseline: year %s is not in the data, "
+                                    "expected one of %s" % (self.compare_baseline,
+                                                            ", ".join(str(year) for year in years)))
+            return [tuple(sorted((self.compare_baseline, year)))
+                    for year in years if year != self.compare_baseline]
+        if self.compare_all:
+            return list(itertools.combinations(years, 2))
+        return []
 
     def process_data(self):
+        # Incremental runs only process the appended rows, the rows rejected
+        # by the earlier runs stay in the quarantine file
+        # The rejected rows are kept for the frame cache
+        self.quarantine.start(append=self.ingestor is not None and self.ingestor.previous_cube is not None,
+                              keep=self.frame_cache is not None)
+        if not self.memory_report:
+            self.fatalities_df = self.process_frame(self.fatalities_df, quarantine=self.quarantine)
+            self.quarantine.finish()
+            return
+        processed = self.process_frame(self.fatalities_df, compact=False, quarantine=self.quarantine)
+        self.quarantine.finish()
+        self.fatalities_df = schema.compact_frame(processed)
+        INFO("Memory footprint of the processed data:\n%s",
+             schema.memory_report(processed, self.fatalities_df))
+
+    @staticmethod
+    def process_frame(df, compact=True, quarantine=None):
+        DEBUG("Validating the rows")
+        failures = validation.validate(df)
+        rejected = validation.rejected_rows(failures, len(df))
         DEBUG("Filtering applicable years")
-        self.fatalities_df = self.fatalities_df[(
-            self.fatalities_df['year'] > Constants.STARTING_YEAR)].dropna()
-        DEBUG("Populating hours and minutes columns from time")
-        self.fatalities_df['hour'] = self.fatalities_df['time'].apply(
-            lambda x: int(str(x).split(':')[0]))
-        self.fatalities_df['minutes'] = self.fatalities_df['time'].apply(
-            lambda x: int(str(x).split(':')[1]))
-        DEBUG("Populating unrecognized road_users as 'others'")
-        self.fatalities_df.loc[~self.fatalities_df['road_user'].isin(
-            Constants.PRIMARY_ROAD_USERS), 'road_user'] = 'Other'
-        DEBUG("Populating involvement column")
-        self.fatalities_df['involvement'] = self.fatalities_df.apply(lambda x: 'yes' if any(
-            x[col] == 'yes' for col in Constants.INVOLVEMENT_COLUMNS) else 'no', axis=1)
+        # Rows of earlier years are out of scope rather than invalid
+        earlier = (pd.to_numeric(df['year'], errors='coerce') <= Constants.STARTING_YEAR).to_numpy()
+        if quarantine is not None:
+            quarantine.add(df, failures, rejected & ~earlier)
+        df = df[~(rejected | earlier)]
+        # Integer columns are read as floats wherever they have missing values
+        # and as text wherever they have malformed ones
+        df = df.assign(**{column: pd.to_numeric(df[column]).astype(np.int64)
+                          for column in Constants.INTEGER_COLUMNS})
+        DEBUG("Populating derived columns")
+        df = derive_columns(df)
+        if compact:
+            DEBUG("Converting to the compact schema")
+            df = schema.compact_frame(df)
+        return df
+
+    def stream_data(self):
+        """Reads, processes and counts the data file chunk by chunk.
+
+        Only the columns in Constants.INPUT_DTYPES are read, the text ones
+        with that dtype, and no more than chunk_size rows are held in memory at a time.
+        Each chunk goes through process_frame() and its counts are merged into
+        the cube, which ends up the same as that of the whole file.
+        """
+        INFO("Streaming %s in chunks of %d rows",
+             self.data_file_path, self.chunk_size)
+        self.cube = None
+        self.streamed_rows = 0
+        # Numeric columns are left for pandas to infer, so that malformed
+        # values are read as text and quarantined rather than failing the read
+        dtypes = dict((column, dtype) for column, dtype in Constants.INPUT_DTYPES.items()
+                      if dtype == "object")
+        self.quarantine.start()
+        for data_file in self.data_files:
+            for chunk in pd.read_csv(data_file, chunksize=self.chunk_size,
+                                     usecols=list(Constants.INPUT_DTYPES), dtype=dtypes):
+                self.streamed_rows += len(chunk)
+                chunk_cube = CountCube.build(self.process_frame(chunk, quarantine=self.quarantine),
+                                             self.get_cube_fields(), facet=self.get_cube_facet())
+                self.cube = chunk_cube if self.cube is None else self.cube.merge(chunk_cube)
+        self.quarantine.finish()
+        DEBUG("Streamed %d rows", self.streamed_rows)
+
+    def get_cube_fields(self):
+        # The persisted counts of incremental runs have to cover all the
+        # charts as later runs may render any of them
+        if self.ingestor is not None:
+            return Constants.CUBE_FIELDS
+        return registry.required_fields(self.charts)
+
+    def get_cube_facet(self):
+        # Persisted counts are split by state for the same reason
+        if self.ingestor is not None or self.state_charts:
+            return Constants.FACET_FIELD
+        return None
+
+    def build_cube(self):
+        fields = self.get_cube_fields()
+        DEBUG("Building aggregation cube for %s", ", ".join(fields))
+        self.cube = CountCube.build(self.fatalities_df, fields, facet=self.get_cube_facet())
+        if self.ingestor is not None:
+            self.cube = self.ingestor.accumulate(self.cube)
+
+    def get_render_batches(self, compare_pairs=()):
+        """Splits the charts to be rendered into batches.
+
+        Every selected chart is a batch of its own, while the compare charts
+        of the compare pairs are batched compare_batch_size pairs at a time,
+        which keeps the per task overhead of the worker processes low.
+
+        Args:
+          compare_pairs (list): (start year, end year) tuples
+
+        Returns: List of batches, each a list of (chart name, pair) tuples
+                 where pair is None for the charts of the compare years
+        """
+        batches = [[(spec.name, None)] for spec in self.charts]
+        compare_charts = [spec.name for spec in self.charts if spec.compare]
+        for start in range(0, len(compare_pairs), self.compare_batch_size):
+            batches.append([(chart_name, pair)
+                            for pair in compare_pairs[start:start + self.compare_batch_size]
+                            for chart_name in compare_charts])
+        return batches
+
+    def render_charts(self, batches):
+        # Payloads take milliseconds, far less than starting worker processes
+        if self.jobs > 1 and self.output_format != "json":
+            self.render_charts_parallel(batches)
+            return
+        for batch in batches:
+            for chart_name, pair in batch:
+                self.render_chart(chart_name, pair)
+        self.release_figure()
+
+    def render_chart(self, chart_name, pair=None):
+        """Renders a chart.
+
+        Args:
+          chart_name (str): Name of the chart
+          pair (tuple): (start year, end year) to render a compare chart for
+                        instead of the compare start and end years
+
+        Returns: Fingerprint of the inputs of the chart
+        """
+        self.current_chart = chart_name
+        self.current_pair = pair
+        compare_years = self.start_year, self.end_year
+        if pair is not None:
+            self.start_year, self.end_year = pair
+        chart_key = self._chart_key(chart_name, pair)
+        try:
+            with self._stage("chart:%s" % chart_key):
+                if self.output_format == "json":
+                    self.write_chart_payload(chart_name, pair)
+                else:
+                    getattr(self, registry.get(chart_name).method)()
+        finally:
+            self.current_chart = None
+            self.current_pair = None
+            self.start_year, self.end_year = compare_years
+        return self.chart_fingerprints.get(chart_key)
+
+    def write_chart_payload(self, chart_name, pair=None):
+        chart_payload = payload.build(registry.get(chart_name), self.cube,
+                                      self.start_year, self.end_year)
+        filepath = os.path.join(self.output_dir, Constants.RELATIVE_PAYLOADS_DIR,
+                                self._chart_key(chart_name, pair) + ".json")
+        # Compact separators as the payloads are fetched by the pages
+        if Utils.write_to_file(filepath, json.dumps(chart_payload, separators=(",", ":")),
+                               only_if_changed=True):
+            self.current_stage.add_output(filepath)
+        INFO("Generated %s", filepath)
+
+    def render_charts_parallel(self, batches):
+        INFO("Rendering %d charts with %d worker processes",
+             sum(len(batch) for batch in batches), self.jobs)
+        # The loader is handed to each worker once through the initializer
+        # instead of being pickled along with every chart
+        with ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_chart_worker,
+                                 initargs=(self, logger.get_settings())) as executor:
+            for fingerprints, outputs, stages in executor.map(_render_batch_in_worker, batches):
+                self.chart_fingerprints.update(fingerprints)
+                self.chart_outputs.update(outputs)
+                self.instrumentation.add_stages(stages)
+
+    def get_states(self):
+        """Returns: States of the data, in the order of their categories"""
+        return sorted(self.cube.facets, key=schema.value_sort_key(Constants.FACET_FIELD))
+
+    def render_state_charts(self):
+        """Renders the charts of each state, or writes their payloads"""
+        states = self.get_states()
+        if self.output_format == "json":
+            for state in states:
+                for spec in self.state_charts:
+                    if self._owns_state_chart(state, spec):
+                        self.write_state_chart_payload(spec, state)
+            return
+        if self.jobs > 1 and len(states) > 1:
+            INFO("Rendering the charts of %d states with %d worker processes",
+                 len(states), self.jobs)
+            # Every worker draws the figures once for its share of the states
+            shares = [states[start::self.jobs] for start in range(min(self.jobs, len(states)))]
+            with ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_chart_worker,
+                                     initargs=(self, logger.get_settings())) as executor:
+                for fingerprints, outputs, stages in executor.map(_render_states_in_worker, shares):
+                    self.chart_fingerprints.update(fingerprints)
+                    self.chart_outputs.update(outputs)
+                    self.instrumentation.add_stages(stages)
+            return
+        self.render_facet_charts(states)
+
+    def render_facet_charts(self, states):
+        """Renders the charts of the given states, drawing the figure of each
+        chart once and then only updating the data it plots.
+
+        Returns: List of the keys of the charts
+        """
+        charts = [FacetChart.create(spec, self.cube) for spec in self.state_charts]
+        chart_keys = []
+        try:
+            for state in states:
+                cube = self.cube.facet(state)
+                for facet_chart in charts:
+                    spec = facet_chart.spec
+                    if not self._owns_state_chart(state, spec):
+                        continue
+                    chart_key = facets.chart_key(Constants.FACET_FIELD, state, spec.name)
+                    chart_keys.append(chart_key)
+                    with self._stage("chart:%s" % chart_key):
+                        counts = facet_chart.counts(cube)
+                        if self._is_output_current(spec.name, chart_key, state,
+                                                   facet_chart.labels, counts):
+                            continue
+                        fig, _ = facet_chart.render(counts)
+                        self._save_chart(fig, chart_key)
+        finally:
+            for facet_chart in charts:
+                facet_chart.close()
+        return chart_keys
+
+    def _owns_state_chart(self, state, spec):
+        return self.shard_plan is None or self.shard_plan.owns(shards.chart_unit(
+            facets.chart_key(Constants.FACET_FIELD, state, spec.name)))
+
+    def write_state_chart_payload(self, spec, state):
+        chart_payload = payload.build(spec, self.cube.facet(state))
+        filepath = os.path.join(self.output_dir, Constants.RELATIVE_PAYLOADS_DIR,
+                                facets.chart_key(Constants.FACET_FIELD, state, spec.name) + ".json")
+        if Utils.write_to_file(filepath, json.dumps(chart_payload, separators=(",", ":")),
+                               only_if_changed=True):
+            self.current_stage.add_output(filepath)
+        DEBUG("Generated %s", filepath)
+
+    def _new_figure(self, nrows=1, ncols=1):
+        if not self.reuse_figure:
+            return plt.subplots(nrows, ncols)
+        # Clear and redraw the one canvas kept for the whole run instead of
+        # allocating a new figure and renderer for every chart
+        if self._figure is None:
+            self._figure = plt.figure()
+        else:
+            self._figure.clf()
+        return self._figure, self._figure.subplots(nrows, ncols)
+
+    def release_figure(self):
+        if self._figure is not None:
+            plt.close(self._figure)
+            self._figure = None
 
+    @staticmethod
+    def _chart_key(chart_name, pair=None):
+        # Build cache key of the chart, which is also its path relative to
+        # the charts directory sans extension
+        if pair is None:
+            return chart_name
+        return "compare/%d_%d/%s" % (pair[0], pair[1], chart_name)
+
+    def _chart_image(self, chart_key, url_prefix, sizes):
+        # Charts not rendered by this run are referenced as last saved
+        variants = (self.chart_outputs.get(chart_key) or self.build_cache.outputs.get(chart_key)
+                    or images.default_variants(chart_key, self.image_settings))
+        return images.img_attributes(variants, url_prefix, sizes)
+
+    def _is_chart_current(self, *data):
+        """Fingerprints the data plotted by the chart being rendered.
+
+        Args:
+          data: The aggregated series/frames/values the chart is drawn from,
+                including the compare years for the compare charts
+
+        Returns: True if the chart was already rendered from the same inputs
+                 and can be skipped
+        """
+        return self._is_output_current(self.current_chart,
+                                       self._chart_key(self.current_chart, self.current_pair), *data)
+
+    def _is_output_current(self, chart_name, chart_key, *data):
+        fingerprint = BuildCache.fingerprint(chart_name, Constants.CHART_STYLE, self.image_settings,
+                                             self.renderer_digest, *data)
+        self.chart_fingerprints[chart_key] = fingerprint
+        outputs = self.build_cache.outputs.get(chart_key, [])
+        if self.build_cache.is_current(chart_key, fingerprint, [os.path.join(
+                self.charts_dir, variant["file"]) for variant in outputs]):
+            self.chart_outputs[chart_key] = outputs
+            DEBUG("Skipping %s, its inputs did not change", chart_key)
+            self.current_stage.set(skipped=True)
+            return True
+        return False
+
+    @chart("fatalities_by_year", field="year", kind="line", depends=[])
     def chart_fatalities_by_year(self):
-        fig, ax = plt.subplots()
+        df = self.cube.year_totals()
+        if self._is_chart_current(df):
+            return
+        fig, ax = self._new_figure()
 
         ax.set_ylabel('Road Fatalities')
         ax.set_xlabel('Year')
-        df = self.fatalities_df.groupby('year').size()
         ax.plot(df.index, df.values)
         self._generate_chart(ax, fig)
 
+    @chart("fatalities_by_state_compare", field="state", kind="bar", compare=True)
     def chart_fatalities_by_state_compare(self):
-        fig, ax = plt.subplots()
-        change_by_state = self.fatalities_df[self.fatalities_df['year'].isin(
-            [self.start_year, self.end_year])].groupby(['state', 'year']).size().reset_index(name='Road Fatalities')
+        change_by_state = self.cube.compare('state', [self.start_year, self.end_year])
+        if self._is_chart_current(self.start_year, self.end_year, change_by_state):
+            return
+        fig, ax = self._new_figure()
         ax.set_xlim(0, change_by_state.index.size)
         ax.set_yticks(
             np.arange(0, change_by_state["Road Fatalities"].max(), Constants.STEP_SIZE))
@@ -90,146 +645,166 @@ class Loader(object):
 
         self._generate_chart(ax, fig, rotate_xlabels=True)
 
+    @chart("fatalities_by_state", field="state", kind="bar")
     def chart_fatalities_by_state(self):
-        fig, ax = plt.subplots()
+        df = self.cube.totals('state').sort_values()
+        if self._is_chart_current(df):
+            return
+        fig, ax = self._new_figure()
         ax.set_ylabel('Road Fatalities')
         ax.set_xlabel('State')
 
-        df = self.fatalities_df.groupby('state').size().sort_values()
-
         ax.set_xlim(0, df.index.size)
         # ax.set_yticks(np.arange(0, df.values.max(), Constants.STEP_SIZE))
         ax.bar(df.index, df.values, align='center')
 
         self._generate_chart(ax, fig, rotate_xlabels=True)
 
+    @chart("fatalities_by_hour_compare", field="hour", kind="bar", compare=True)
     def chart_fatalities_by_hour_compare(self):
-        fig, ax = plt.subplots()
-        change_by_hour = self.fatalities_df[self.fatalities_df['year'].isin(
-            [self.start_year, self.end_year])].groupby(['hour', 'year']).size().reset_index(name='Road Fatalities')
+        change_by_hour = self.cube.compare('hour', [self.start_year, self.end_year])
+        if self._is_chart_current(self.start_year, self.end_year, change_by_hour):
+            return
+        fig, ax = self._new_figure()
         sns.barplot(x='hour', y='Road Fatalities', hue='year', data=change_by_hour.sort_values(
             by='Road Fatalities'), ax=ax)
 
         self._generate_chart(ax, fig, rotate_xlabels=True)
 
+    @chart("fatalities_by_hour", field="hour", kind="bar")
     def chart_fatalities_by_hour(self):
-        fig, ax = plt.subplots()
+        df = self.cube.totals('hour')
+        if self._is_chart_current(df):
+            return
+        fig, ax = self._new_figure()
         ax.set_ylabel('Road Fatalities')
-        df = self.fatalities_df.groupby('hour').size()
         ax.bar(df.index, df.values)
         self._generate_chart(ax, fig)
 
+    @chart("fatalities_by_gender_compare", field="gender", kind="pie", compare=True)
     def chart_fatalities_by_gender_compare(self):
         self._chart_fatalities_by_field_compare(field="gender")
 
+    @chart("fatalities_by_gender", field="gender", kind="pie")
     def chart_fatalities_by_gender(self):
-        fig, ax = plt.subplots()
-        df = self.fatalities_df.groupby('gender').size()
-        ax.pie(df.values, labels=df.index, autopct='%1.1f%%',
-               textprops={"fontsize": 7})
-        self._generate_chart(ax, fig)
+        self._chart_fatalities_by_field(field="gender")
 
+    @chart("fatalities_by_road_user_compare", field="road_user", kind="pie", compare=True)
     def chart_fatalities_by_road_user_compare(self):
         self._chart_fatalities_by_field_compare(field="road_user")
 
+    @chart("fatalities_by_road_user", field="road_user", kind="pie")
     def chart_fatalities_by_road_user(self):
-        fig, ax = plt.subplots()
-        df = self.fatalities_df.groupby('road_user').size()
+        self._chart_fatalities_by_field(field="road_user")
+
+    def _chart_fatalities_by_field(self, field):
+        df = self.cube.totals(field)
+        if self._is_chart_current(df):
+            return
+        fig, ax = self._new_figure()
         ax.pie(df.values, labels=df.index, autopct='%1.1f%%',
                textprops={"fontsize": 7})
         self._generate_chart(ax, fig)
 
     def _chart_fatalities_by_field_compare(self, field):
-        fig, (ax1, ax2) = plt.subplots(1, 2)
+        start_df = self.cube.for_year(field, self.start_year)
+        end_df = self.cube.for_year(field, self.end_year)
+        if self._is_chart_current(self.start_year, self.end_year, start_df, end_df):
+            return
+        fig, (ax1, ax2) = self._new_figure(1, 2)
         ax1.set_title(
             'Change in Road Fatalities by %s between %s and %s' % (field.capitalize(), self.start_year, self.end_year))
         ax1.set_title(self.start_year)
         ax2.set_title(self.end_year)
-        df = self.fatalities_df[self.fatalities_df['year'].isin(
-            [self.start_year])].groupby(field).size()
-        ax1.pie(df.values, labels=df.index, autopct='%1.1f%%',
+        ax1.pie(start_df.values, labels=start_df.index, autopct='%1.1f%%',
                 textprops={"fontsize": 7})
-        df = self.fatalities_df[self.fatalities_df['year'].isin(
-            [self.end_year])].groupby(field).size()
-        ax2.pie(df.values, labels=df.index, autopct='%1.1f%%',
+        ax2.pie(end_df.values, labels=end_df.index, autopct='%1.1f%%',
                 textprops={"fontsize": 7})
         self._generate_chart(ax=(ax1, ax2), fig=fig)
 
+    @chart("fatalities_by_crash_type_compare", field="crash_type", kind="pie", compare=True)
     def chart_fatalities_by_crash_type_compare(self):
         self._chart_fatalities_by_field_compare(field="crash_type")
 
+    @chart("fatalities_by_crash_type", field="crash_type", kind="pie")
     def chart_fatalities_by_crash_type(self):
-        fig, ax = plt.subplots()
-        df = self.fatalities_df.groupby('crash_type').size()
-        ax.pie(df.values, labels=df.index,
-               autopct='%1.1f%%', textprops={"fontsize": 7})
-        self._generate_chart(ax, fig)
+        self._chart_fatalities_by_field(field="crash_type")
+
+    def _histogram(self, field, years=None):
+        """Bins of Constants.STEP_SIZE of a whole number field, drawn from
+        its distribution rather than from the rows.
+
+        Returns: (edges, counts) numpy arrays
+        """
+        return self.cube.distribution(field, years=years).histogram(Constants.STEP_SIZE)
 
+    @chart("fatalities_by_age_compare", field="age", kind="histogram", compare=True)
     def chart_fatalities_by_age_compare(self):
-        fig, (ax1, ax2) = plt.subplots(1, 2)
+        start_edges, start_counts = self._histogram('age', years=[self.start_year])
+        end_edges, end_counts = self._histogram('age', years=[self.end_year])
+        if self._is_chart_current(self.start_year, self.end_year, start_counts, end_counts):
+            return
+        fig, (ax1, ax2) = self._new_figure(1, 2)
         ax1.text(0.5, 1, self.start_year,
                  transform=ax1.transAxes, fontsize=10)
         ax2.text(0.5, 1, self.end_year,
                  transform=ax2.transAxes, fontsize=10)
-        filtered = self.fatalities_df.loc[self.fatalities_df['year']
-                                          == self.start_year, 'age']
-        sns.histplot(filtered, bins=range(
-            0, filtered.values.max()+(Constants.STEP_SIZE*2), Constants.STEP_SIZE), kde=False, ax=ax1)
-        filtered = self.fatalities_df.loc[self.fatalities_df['year']
-                                          == self.end_year, 'age']
-        sns.histplot(filtered, bins=range(
-            0, filtered.values.max()+(Constants.STEP_SIZE*2), Constants.STEP_SIZE), kde=False, ax=ax2)
+        # Each bin is drawn as a single value, its lower edge, weighted by
+        # the count of the bin. The edges are passed as lists, seaborn warns
+        # when comparing an array of them to "auto"
+        sns.histplot(x=pd.Index(start_edges[:-1], name='age'), weights=start_counts,
+                     bins=list(start_edges), kde=False, ax=ax1)
+        sns.histplot(x=pd.Index(end_edges[:-1], name='age'), weights=end_counts,
+                     bins=list(end_edges), kde=False, ax=ax2)
         self._generate_chart(ax=(ax1, ax2), fig=fig)
 
+    @chart("fatalities_by_age", field="age", kind="histogram")
     def chart_fatalities_by_age(self):
-        fig, ax = plt.subplots()
+        edges, counts = self._histogram('age')
+        if self._is_chart_current(counts):
+            return
+        fig, ax = self._new_figure()
         ax.set_xlabel('Age')
-        # STEP_SIZE*2 is needed because range does not
-        # include the end value and hist() again doesn't include
-        # and count the end range i.e, 10 -20 means it counts values
-        # from 10 to 19 without including 20.
-        bins = range(0, self.fatalities_df["age"].max(
-        )+(Constants.STEP_SIZE*2), Constants.STEP_SIZE)
-        ax.hist(self.fatalities_df["age"], bins)
+        ax.hist(edges[:-1], edges, weights=counts)
         self._generate_chart(ax, fig)
 
+    @chart("fatalities_by_speed_limit", field="speed_limit", kind="histogram")
     def chart_fatalities_by_speed_limit(self):
-        fig, ax = plt.subplots()
+        edges, counts = self._histogram('speed_limit')
+        if self._is_chart_current(counts):
+            return
+        fig, ax = self._new_figure()
+        ax.set_xlabel('Speed Limit')
         ax.set_ylabel('Road Fatalities')
-        bins = range(0, self.fatalities_df["speed_limit"].max(
-        )+(Constants.STEP_SIZE*2), Constants.STEP_SIZE)
-        ax.hist(self.fatalities_df["age"], bins)
+        ax.hist(edges[:-1], edges, weights=counts)
         self._generate_chart(ax, fig)
 
+    @chart("fatalities_by_speed_limit_compare", field="speed_limit", kind="line", compare=True)
     def chart_fatalities_by_speed_limit_compare(self):
-        fig, ax = plt.subplots()
-        ax.set_xlabel('Speed Limit')
+        start_counts = self.cube.for_year('speed_limit', self.start_year)
+        end_counts = self.cube.for_year('speed_limit', self.end_year)
+        if self._is_chart_current(self.start_year, self.end_year, start_counts, end_counts):
+            return
+        fig, ax = self._new_figure()
         ax.set_ylabel('Road Fatalities')
-        self.fatalities_df.loc[self.fatalities_df['year'] == self.start_year, 'speed_limit'].value_counts(
-        ).sort_index().plot(ax=ax, xlim=[10, 150], label=self.start_year)
-        self.fatalities_df.loc[self.fatalities_df['year'] == self.end_year, 'speed_limit'].value_counts(
-        ).sort_index().plot(ax=ax, xlim=[10, 150], label=self.end_year)
+        start_counts.plot(ax=ax, xlim=[10, 150], label=self.start_year)
+        end_counts.plot(ax=ax, xlim=[10, 150], label=self.end_year)
+        # Set after plotting as pandas labels the axis with the index name
+        ax.set_xlabel('Speed Limit')
         ax.legend()
         self._generate_chart(ax, fig)
 
+    @chart("fatalities_by_dayweek_compare", field="dayweek", kind="pie", compare=True)
     def chart_fatalities_by_dayweek_compare(self):
         self._chart_fatalities_by_field_compare(field="dayweek")
 
+    @chart("fatalities_by_dayweek", field="dayweek", kind="pie")
     def chart_fatalities_by_dayweek(self):
-        fig, ax = plt.subplots()
-
-        df = self.fatalities_df.groupby('dayweek').size()
-
-        custom_dict = {
-            'Monday': 1,
-            "Tuesday": 2,
-            "Wednesday": 3,
-            "Thursday": 4,
-            "Friday": 5,
-            "Saturday": 6,
-            "Sunday": 7
-        }
-        df = df.sort_index(key=lambda x: x.map(custom_dict))
+        # Already in the Monday to Sunday order of the dayweek categories
+        df = self.cube.totals('dayweek')
+        if self._is_chart_current(df):
+            return
+        fig, ax = self._new_figure()
         ax.pie(df.values, labels=df.index,
                autopct='%1.1f%%', textprops={"fontsize": 7})
         self._generate_chart(ax, fig, grid=False)
@@ -246,16 +821,9 @@ class Loader(object):
             # plt.yticks(fontsize=7)
             if ax_unit:
                 ax_unit.grid(grid)
-        level = 2  # min stack level expected
-        while True:
-            caller = Utils.get_caller_name(level=level)
-            if caller.startswith("chart_"):
-                break
-            level += 1
-        caller = re.sub(r'^chart_', "", caller)
-        INFO("Generated %s" % caller)
-        fig.savefig(os.path.join(self.charts_dir,
-                    caller + ".jpg"), bbox_inches='tight')
+        self._save_chart(fig, self._chart_key(self.current_chart, self.current_pair))
+        if fig is not self._figure:
+            plt.close(fig)
         # mpld3 offers interactive charts but it changes the
         # formatting of what matplotlib graph originally offered
         # So going with the approach of saving in jpg format.
@@ -263,156 +831,192 @@ class Loader(object):
 
         # mpld3.save_html(fig, os.path.join(self.charts_dir, caller + ".html"))
 
-    @staticmethod
-    def get_base_template():
-        return '''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-  <title>Australian Road Fatalities</title>
-  <meta charset="utf-8">
-  <meta name="viewport" content="width=device-width, initial-scale=1">
-  <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css" rel="stylesheet" integrity="sha384-GLhlTQ8iRABdZLl6O3oVMWSktQOp6b7In1Zl3/Jr59b6EGGoI1aFkw7cmDA6j6gD" crossorigin="anonymous">
-  <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.0.2/dist/js/bootstrap.bundle.min.js" integrity="sha384-MrcW6ZMFYlzcLA8Nl+NtUVF0sA7MsXsP1UyJoMp4YLEuNSfAP+JcXn/tWtIaxVXM" crossorigin="anonymous"></script>
-</head>
-<body>
-    <nav class="navbar navbar-expand-lg navbar-light bg-light">
-        <div class="container-fluid">
-            <a class="navbar-brand" href="../index.html">Home</a>
-            <button class="navbar-toggler" type="button" data-bs-toggle="collapse" data-bs-target="#navbarNavDropdown" aria-controls="navbarNavDropdown" aria-expanded="false" aria-label="Toggle navigation">
-              <span class="navbar-toggler-icon"></span>
-            </button>
-          <div class="collapse navbar-collapse" id="navbarNavDropdown">
-            <ul class="navbar-nav">
-              <li class="nav-item dropdown">
-                <a class="nav-link dropdown-toggle" href="#" id="navbarDropdownMenuLink" role="button" data-bs-toggle="dropdown" aria-expanded="false">
-                    Impact of fields
-                </a>
-                <ul class="dropdown-menu" aria-labelledby="navbarDropdownMenuLink">
-                  <li><a class="dropdown-item" href="age_gender.html">Age and Gender</a></li>
-                  <li><a class="dropdown-item" href="state.html">State </a></li>
-                  <li><a class="dropdown-item" href="dayweek_hour_year.html">Dayweek, Hour and Year</a></li>
-                  <li><a class="dropdown-item" href="road_user.html">Road User Role</a></li>
-                  <li><a class="dropdown-item" href="crash_type.html">Crash Type</a></li>
-                  <li><a class="dropdown-item" href="speed_limit.html">Speed Limit</a></li>
-                 </ul>
-              </li>
-            </ul>
-          </div>
-           <a class="navbar-brand" href="../../data/traffic.csv">Download data file</a>
-        </div>
-      </nav>
-{content}
-</body>
-</html>
-'''
+    def _save_chart(self, fig, chart_key):
+        INFO("Generated %s", chart_key)
+        variants = images.save_figure(fig, self.charts_dir, chart_key, self.image_settings)
+        images.remove_stale(self.charts_dir, self.build_cache.outputs.get(chart_key), variants)
+        self.chart_outputs[chart_key] = variants
+        for variant in variants:
+            self.current_stage.add_output(os.path.join(self.charts_dir, variant["file"]))
+
+    def _render_page(self, filepath, template_name, **context):
+        """Renders a template to a page, with the links of the navigation
+        bar relative to the directory of the page"""
+        if self.shard_plan is not None and not self.shard_plan.owns(self._page_unit(filepath)):
+            DEBUG("Skipped %s, it is generated by another shard", filepath)
+            return
+        links = templates.navigation(os.path.join(self.output_dir, "static"), os.path.dirname(filepath),
+                                     [registry.group_name(grp) for grp in self.get_groups()],
+                                     self.get_data_files(), self.get_state_pages(), self.get_compare_page())
+        self._write_page(filepath, self.jinja_env.get_template(template_name).render(
+            **dict(links, **context)))
+
+    def get_groups(self):
+        """Returns: Groups of Constants.GROUPS with a selected chart, whose
+                 pages are generated"""
+        groups = set(spec.group for spec in self.charts)
+        return [grp for grp in Constants.GROUPS if registry.group_name(grp) in groups]
+
+    def get_data_files(self):
+        """Returns: (path, name) tuples of the data files, for the download links"""
+        return [(data_file, os.path.relpath(data_file, self.data_source.root))
+                for data_file in self.data_source.files]
+
+    def get_state_pages(self):
+        """Returns: (path, state) tuples of the state pages, if generated"""
+        return [(self._state_page_path(state), state)
+                for state in (self.get_states() if self.state_charts else ())]
+
+    def get_compare_page(self):
+        """Returns: Path of compare.html, if generated"""
+        return self._compare_page_path() if self.compare_pairs else None
+
+    def _write_page(self, filepath, content):
+        if Utils.write_to_file(filepath, content, only_if_changed=True):
+            DEBUG("Wrote %s", filepath)
+            self.current_stage.add_output(filepath)
+        else:
+            DEBUG("Skipped writing %s, its content did not change", filepath)
+
+    def _page_unit(self, filepath):
+        return shards.page_unit(os.path.relpath(filepath, self.output_dir))
+
+    def _group_page_path(self, grp):
+        return os.path.join(self.output_dir, "static", "auto", registry.group_name(grp) + ".html")
+
+    def _compare_page_path(self, pair=None):
+        # Page of the compare charts of a year pair, or the one linking them all
+        return os.path.join(self.output_dir, "static", "auto", "compare.html" if pair is None else
+                            "compare_%d_%d.html" % pair)
+
+    def get_page_paths(self, compare_pairs=()):
+        """Returns: Paths of all the pages but index.html, in the order they
+        are generated in"""
+        paths = [self._group_page_path(grp) for grp in self.get_groups()]
+        if compare_pairs:
+            paths += [self._compare_page_path(pair) for pair in compare_pairs]
+            paths.append(self._compare_page_path())
+        return paths + [path for path, _ in self.get_state_pages()]
+
+    def get_shard_units(self, batches, compare_pairs):
+        """Outputs of the whole build, see ShardPlan.
+
+        Returns: List of the chart outputs followed by the pages
+        """
+        units = [shards.chart_unit(self._chart_key(*item)) for batch in batches for item in batch]
+        units += [shards.chart_unit(facets.chart_key(Constants.FACET_FIELD, state, spec.name))
+                  for state in (self.get_states() if self.state_charts else ())
+                  for spec in self.state_charts]
+        return units + [self._page_unit(path) for path in self.get_page_paths(compare_pairs)]
+
+    def write_shard_manifest(self):
+        files, charts = {}, {}
+        for unit in self.shard_plan.owned:
+            kind, name = unit.split(":", 1)
+            if kind == "page":
+                files[unit] = [name]
+            elif self.output_format == "json":
+                files[unit] = [os.path.join(Constants.RELATIVE_PAYLOADS_DIR, name + ".json")]
+            else:
+                variants = self.chart_outputs.get(name) or []
+                files[unit] = [os.path.join(Constants.RELATIVE_CHARTS_DIR, variant["file"])
+                               for variant in variants]
+                charts[name] = {"fingerprint": self.chart_fingerprints.get(name), "outputs": variants}
+        site = {
+            "output_format": self.output_format,
+            "groups": [registry.group_name(grp) for grp in self.get_groups()],
+            "data_files": [(os.path.relpath(path, self.output_dir), name)
+                           for path, name in self.get_data_files()],
+            "state_pages": [(os.path.relpath(path, self.output_dir), state)
+                            for path, state in self.get_state_pages()],
+            "compare_page": (os.path.relpath(self._compare_page_path(), self.output_dir)
+                             if self.compare_pairs else None)
+        }
+        self.shard_plan.write_manifest(self.output_dir, files, charts, site)
 
     def generate_html_pages(self):
-        for grp in Constants.GROUPS:
+        # index.html and the script are written by the merge of a sharded build
+        if self.output_format == "json" and self.shard_plan is None:
+            self._write_page(os.path.join(self.output_dir, Constants.RELATIVE_CHART_SCRIPT),
+                             Utils.read_file(os.path.join(os.path.dirname(__file__), "assets", "charts.js")))
+        for grp in self.get_groups():
             self.generate_html_page(grp)
 
     def generate_html_page(self, grp):
-        template = self.get_base_template()
-        content = '''
-        {% for field in grp -%}
-        <h3>{{ field |capitalize }}</h3>
-        <div style="width: 100%;">
-            <div style="width: 50%; float: left;">
-            <h4>Impact of {{ field }} over years</h4>
-            <img src="../images/auto/charts/fatalities_by_{{ field }}.jpg" class="img-fluid rounded float-left" alt="{{ field }}">
-            </div>
-            <div style="width: 50%; float: right;">
-              <h4>Comparison statistics of {{ field }} between {{ start }} and {{ end }}</h4>
-            <img src="../images/auto/charts/fatalities_by_{{ field }}_compare.jpg" class="img-fluid rounded float-left" alt="{{ field }}">
-            </div>
-        </div>
-        {% endfor %}
-'''
-
-        template = template.format(content=content)
-
-        jinja_template = self.jinja_env.from_string(template)
-        final_content = jinja_template.render(
-            grp=grp, start=self.start_year, end=self.end_year)
-        filepath = os.path.join(
-            self.project_dir, "static", "auto", "_".join(grp) + ".html")
-        DEBUG("Writing %s" % filepath)
-        Utils.write_to_file(filepath, final_content)
+        img = {}
+        for field in grp:
+            for chart_key in ("fatalities_by_" + field, "fatalities_by_%s_compare" % field):
+                img[chart_key] = self._chart_image(chart_key, "../images/auto/charts/",
+                                                   "(max-width: 768px) 100vw, 50vw")
+        self._render_page(self._group_page_path(grp), "group.html", grp=grp, start=self.start_year,
+                          end=self.end_year, json_output=self.output_format == "json", img=img)
+
+    def generate_compare_pages(self, compare_pairs):
+        """Generates a page of the compare charts of each year pair and a
+        compare.html page linking all of them"""
+        specs = [spec for spec in self.charts if spec.compare]
+        for start, end in compare_pairs:
+            filepath = self._compare_page_path((start, end))
+            img = dict((spec.name, self._chart_image(self._chart_key(spec.name, (start, end)),
+                                                     "../images/auto/charts/", "100vw"))
+                       for spec in specs)
+            self._render_page(filepath, "compare_pair.html", specs=specs, start=start, end=end,
+                              json_output=self.output_format == "json", img=img)
+
+        filepath = self._compare_page_path()
+        self._render_page(filepath, "compare.html", pairs=set(compare_pairs),
+                          starts=sorted(set(start for start, _ in compare_pairs)),
+                          ends=sorted(set(end for _, end in compare_pairs)))
+        INFO("Generated the comparisons of %d year pairs, see %s", len(compare_pairs), filepath)
+
+    def _state_page_path(self, state):
+        return os.path.join(self.output_dir, "static", "auto", Constants.FACET_FIELD,
+                            facets.slug(state) + ".html")
+
+    def generate_state_pages(self):
+        """Generates the page of the charts of each state"""
+        for state in self.get_states():
+            img = dict((spec.name, self._chart_image(
+                facets.chart_key(Constants.FACET_FIELD, state, spec.name),
+                "../../images/auto/charts/", "100vw")) for spec in self.state_charts)
+            self._render_page(self._state_page_path(state), "state.html", state=state,
+                              slug=facets.slug(state), specs=self.state_charts,
+                              json_output=self.output_format == "json", img=img)
 
     def generate_index_html(self):
-        # TODO: Remove the redundancy in template string between this
-        # method and get_base_template()
-        template = '''
-        <!DOCTYPE html>
-<html lang="en">
-<head>
-  <title>Australian Road Fatalities</title>
-  <meta charset="utf-8">
-  <meta name="viewport" content="width=device-width, initial-scale=1">
-  <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css" rel="stylesheet" integrity="sha384-GLhlTQ8iRABdZLl6O3oVMWSktQOp6b7In1Zl3/Jr59b6EGGoI1aFkw7cmDA6j6gD" crossorigin="anonymous">
-  <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.0.2/dist/js/bootstrap.bundle.min.js" integrity="sha384-MrcW6ZMFYlzcLA8Nl+NtUVF0sA7MsXsP1UyJoMp4YLEuNSfAP+JcXn/tWtIaxVXM" crossorigin="anonymous"></script>
-</head>
-<body>
-
-    <nav class="navbar navbar-expand-lg navbar-light bg-light">
-        <div class="container-fluid">
-            <a class="navbar-brand" href="#">Home</a>
-            <button class="navbar-toggler" type="button" data-bs-toggle="collapse" data-bs-target="#navbarNavDropdown" aria-controls="navbarNavDropdown" aria-expanded="false" aria-label="Toggle navigation">
-              <span class="navbar-toggler-icon"></span>
-            </button>
-          <div class="collapse navbar-collapse" id="navbarNavDropdown">
-            <ul class="navbar-nav">
-              <li class="nav-item dropdown">
-                <a class="nav-link dropdown-toggle" href="#" id="navbarDropdownMenuLink" role="button" data-bs-toggle="dropdown" aria-expanded="false">
-                    Impact of fields
-                </a>
-                <ul class="dropdown-menu" aria-labelledby="navbarDropdownMenuLink">
-                {% for grp in groups -%}
-                  <li><a class="dropdown-item" href="auto/{{grp| join("_")}}.html">{{grp | join(", ")}}</a></li>
-                  {% endfor %}
-                 </ul>
-              </li>
-            </ul>
-          </div>
-          <a class="navbar-brand" href="../data/traffic.csv">Download data file</a>
-        </div>
-      </nav>
-  
-<div class="container">
-  <h1>Australian Road Fatalities</h1>
-  <br>
-  <h3>Key Statistics</h3>
-  <ul>
-    <li>19,768,518 estimated number of vehicles</li>
-    <li>238,499 million kilometres travelled, an average of 12.1 thousand kilometres per vehicle</li>
-    <li>33,019 megalitres of fuel consumed</li>
-    <li>223,949 million tonne-kilometres of freight moved</li>
-  </ul>
-
-  <a href="https://www.abs.gov.au/statistics/industry/tourism-and-transport/survey-motor-vehicle-use-australia/latest-release#key-statistics">Source</a>
-
-  <br><br>
-  <h3>Goal</h3>
-    
-    With the increasing population and increasing usage, keeping the roads safer is more and more important.<br>
-    <img src="images/states.jpg" class="img-fluid" alt="States">
-  <p>
-    This is a informative web site about Australian Road Fatalities over 
-    the last 8 years, showing summary statistics about the crash types, speed limits, 
-    vehicle types, times of day, and the ages and genders of the people who died. 
-    This will help you to get insights into the data, and to identify trends that are
-    changing over time.
-  </p>
-  </div>
-
-</body>
-</html>
-
-'''
-        jinja_template = self.jinja_env.from_string(template)
-        final_content = jinja_template.render(
-            groups=Constants.GROUPS)
         filepath = os.path.join(
-            self.project_dir, "static", "index.html")
-        DEBUG("Writing %s" % filepath)
-        Utils.write_to_file(filepath, final_content)
+            self.output_dir, "static", "index.html")
+        self._render_page(filepath, "index.html")
+
+
+# Per process state of the chart worker processes used by
+# Loader.render_charts_parallel()
+_worker_loader = None
+
+
+def _init_chart_worker(loader, log_settings):
+    global _worker_loader
+    # Workers log directly as they exit without running the atexit handler
+    # that writes out the queued records
+    logger.setup_logging(**dict(log_settings, use_queue=False))
+    Loader.apply_style()
+    # Only the stages of the charts rendered by the worker are reported back
+    loader.instrumentation.take_stages()
+    _worker_loader = loader
+
+
+def _render_batch_in_worker(batch):
+    fingerprints, outputs = {}, {}
+    for chart_name, pair in batch:
+        chart_key = Loader._chart_key(chart_name, pair)
+        fingerprints[chart_key] = _worker_loader.render_chart(chart_name, pair)
+        outputs[chart_key] = _worker_loader.chart_outputs.get(chart_key)
+    return fingerprints, outputs, _worker_loader.instrumentation.take_stages()
+
+
+def _render_states_in_worker(states):
+    chart_keys = _worker_loader.render_facet_charts(states)
+    fingerprints = dict((chart_key, _worker_loader.chart_fingerprints.get(chart_key))
+                        for chart_key in chart_keys)
+    outputs = dict((chart_key, _worker_loader.chart_outputs.get(chart_key)) for chart_key in chart_keys)
+    return fingerprints, outputs, _worker_loader.instrumentation.take_stages()
@@ -1,33 +1,53 @@
-"""Logging module. This can be extended with more features like
-logging to file as well as console, etc.,
+"""Logging module. Logs to the console and optionally to a file as well,
+either directly or through a queue drained by a background thread so that
+logging never blocks on I/O.
+
+Messages are formatted lazily from their arguments, eg:
+INFO("Generated %s", chart_name), and calls below the logging level return
+before doing any work. The file name and line number of the caller are taken
+from the log record.
 """
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
-import traceback
 
 NAME = "WEBSITE_GENERATOR"
 
+_logger = logging.getLogger(NAME)
+_listener = None
+_settings = {}
 
-def setup_logging(log_level="DEBUG"):
+
+def setup_logging(log_level="DEBUG", log_file=None, use_queue=False):
     """Configure the logger object
 
     Args:
-      log_level (str): The minimum log level severity that should be considered
-                       for logging.
-                       Defaults to 'DEBUG'
+      log_level (str/int): The minimum log level severity that should be
+                           considered for logging.
+                           Defaults to 'DEBUG'
+      log_file (str): File the logs are written to along with the console.
+                      Defaults to None, which only logs to the console
+      use_queue (bool): Hand the log records to a queue that a background
+                        thread writes to the console and log file.
+                        Defaults to False
     """
-
-    log_level = getattr(logging, log_level)
+    global _listener
+    if isinstance(log_level, str):
+        log_level = getattr(logging, log_level)
+    _settings.update(log_level=log_level, log_file=log_file, use_queue=use_queue)
     # Custom variables
     logging.marker = "-" * 60
     logging.step = 1
     logging.stage = ''
 
     # Create the loggers
-    logging.website_generator_logger = logging.getLogger(NAME)
+    logging.website_generator_logger = _logger
 
     # Remove all existing handlers
-    logging.website_generator_logger.handlers = []
+    stop_logging()
+    _logger.handlers = []
 
     # Disable the root logger
     logging.getLogger().disabled = True
@@ -37,20 +57,46 @@ def setup_logging(log_level="DEBUG"):
 
     # setup console handler
     console_handler = logging.StreamHandler(stream=sys.stdout)
-    console_handler.setFormatter(formatter)
-    logging.website_generator_logger.addHandler(console_handler)
+    handlers = [console_handler]
+    # setup file handler
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    if use_queue:
+        records = queue.SimpleQueue()
+        _logger.addHandler(logging.handlers.QueueHandler(records))
+        _listener = logging.handlers.QueueListener(records, *handlers)
+        _listener.start()
+    else:
+        for handler in handlers:
+            _logger.addHandler(handler)
 
     # configure logger
-    logging.website_generator_logger.setLevel(log_level)
-    logging.website_generator_logger.propagate = 0
+    _logger.setLevel(log_level)
+    _logger.propagate = 0
+
+
+def stop_logging():
+    """Writes out the queued log records and stops the queue's thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
 
 
 def __get_formatter():
     formatter = logging.Formatter('%(asctime)s (%(threadName)s) %(levelname)s '
-                                  '[%(file_line)s] : %(message)s')
+                                  '[%(filename)s:%(lineno)d] : %(message)s')
     return formatter
 
 
+def get_settings():
+    """Returns: dict of the arguments logging was last set up with"""
+    return dict(_settings, log_level=_logger.level)
+
+
 def set_level(level):
     """Sets the logging level to the desired one.
 
@@ -60,45 +106,51 @@ def set_level(level):
     Returns:
       None
     """
-    logging.website_generator_logger.setLevel(level)
+    _logger.setLevel(level)
 
 
-def INFO(msg):
-    logging.website_generator_logger.info(msg, extra=__extra())
+def get_level():
+    """Returns the current logging level of the website generator logger"""
+    return _logger.level
 
 
-def WARN(msg):
-    logging.website_generator_logger.warn(msg, extra=__extra())
+# stacklevel=2 attributes the records to the caller of these functions
 
+def INFO(msg, *args):
+    if _logger.isEnabledFor(logging.INFO):
+        _logger.info(msg, *args, stacklevel=2)
 
-def ERROR(msg):
-    logging.website_generator_logger.error(msg, extra=__extra())
 
+def WARN(msg, *args):
+    if _logger.isEnabledFor(logging.WARNING):
+        _logger.warning(msg, *args, stacklevel=2)
 
-def CRITICAL(msg):
-    logging.website_generator_logger.critical(msg, extra=__extra())
 
+def ERROR(msg, *args):
+    if _logger.isEnabledFor(logging.ERROR):
+        _logger.error(msg, *args, stacklevel=2)
 
-def DEBUG(msg):
-    logging.website_generator_logger.debug(msg, extra=__extra())
 
+def CRITICAL(msg, *args):
+    if _logger.isEnabledFor(logging.CRITICAL):
+        _logger.critical(msg, *args, stacklevel=2)
 
-def LOGEXCEPTION(msg):
-    logging.website_generator_logger.exception(msg, extra=__extra())
 
+def DEBUG(msg, *args):
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug(msg, *args, stacklevel=2)
 
-def log(level, msg, *args, **kwargs):
-    logging.website_generator_logger.log(
-        level, msg, extra=__extra(), *args, **kwargs)
 
+def LOGEXCEPTION(msg, *args):
+    if _logger.isEnabledFor(logging.ERROR):
+        _logger.exception(msg, *args, stacklevel=2)
 
-def __extra():
-    frame = traceback.extract_stack()[-3]
-    file_name = frame[0].split("/")[-1]
-    file_line = frame[1]
-    return {
-        'file_line': "%s:%s" % (file_name, file_line)
-    }
+
+def log(level, msg, *args, **kwargs):
+    if _logger.isEnabledFor(level):
+        kwargs.setdefault("stacklevel", 2)
+        _logger.log(level, msg, *args, **kwargs)
 
 
 setup_logging()
+atexit.register(stop_logging)
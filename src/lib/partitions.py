@@ -0,0 +1,116 @@
+"""Fatalities data split across several csv files.
+
+The data file given with -f can also be a directory of csv files, searched
+recursively, or a glob pattern of csv files, eg: "data/traffic_*.csv". All
+the files are expected to have the same columns.
+
+A file whose path relative to the source holds exactly one year, eg:
+traffic_2019.csv or year=2019/part-0.csv, is taken to be the partition of
+that year and is skipped when that year is not needed. Any other file, eg:
+a partition by state, may hold rows of any year and is always read.
+"""
+import glob
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from lib.logger import DEBUG, INFO
+
+YEAR_PATTERN = re.compile(r"(?<!\d)((?:19|20)\d\d)(?!\d)")
+
+
+class DataSource(object):
+    def __init__(self, path, root, files):
+        """
+        Args:
+          path (str): Absolute path of the file, directory or glob pattern
+          root (str): Directory the files are under
+          files (list): Absolute paths of the csv files, sorted
+        """
+        self.path = path
+        self.root = root
+        self.files = files
+
+    @classmethod
+    def resolve(cls, path):
+        """Finds the csv files of a data file, directory or glob pattern.
+
+        Args:
+          path (str): Absolute path of the data file, directory or pattern
+
+        Returns: DataSource object
+
+        Raises: ValueError when no csv file matches
+        """
+        if os.path.isdir(path):
+            root = path
+            files = glob.glob(os.path.join(glob.escape(path), "**", "*.csv"), recursive=True)
+        elif glob.has_magic(path):
+            root = os.path.dirname(path)
+            while glob.has_magic(root):
+                root = os.path.dirname(root)
+            files = [filepath for filepath in glob.glob(path, recursive=True)
+                     if os.path.isfile(filepath)]
+        else:
+            root, files = os.path.dirname(path), [path]
+        if not files:
+            raise ValueError("No csv data files found at %s" % path)
+        return cls(path, root, sorted(files))
+
+    @property
+    def is_single_file(self):
+        return len(self.files) == 1
+
+    def year_of(self, filepath):
+        """Year of the rows of a partition, from its path.
+
+        Returns: int, None when the file may hold the rows of any year
+        """
+        relative = os.path.splitext(os.path.relpath(filepath, self.root))[0]
+        years = set(YEAR_PATTERN.findall(relative))
+        return int(years.pop()) if len(years) == 1 else None
+
+    def years(self):
+        """Years of all the partitions, None when some file may hold the
+        rows of any year"""
+        years = [self.year_of(filepath) for filepath in self.files]
+        return None if None in years else sorted(set(years))
+
+    def select(self, years=None):
+        """Files holding rows of the given years.
+
+        Args:
+          years (iterable): Years needed. Defaults to None, all of them
+
+        Returns: List of file paths
+        """
+        if years is None:
+            return list(self.files)
+        years = set(years)
+        files = [filepath for filepath in self.files
+                 if self.year_of(filepath) is None or self.year_of(filepath) in years]
+        INFO("Reading %d of the %d data files for the years %s", len(files), len(self.files),
+             ", ".join(str(year) for year in sorted(years)))
+        return files
+
+    @staticmethod
+    def read(files, workers=None, **kwargs):
+        """Reads csv files concurrently into a single frame.
+
+        Args:
+          files (list): Paths of the files to read
+          workers (int): Threads reading the files. Defaults to one per
+                         file, up to the number of CPUs
+          kwargs: Passed on to pandas.read_csv()
+
+        Returns: DataFrame of the rows of all the files, in order
+        """
+        if len(files) == 1:
+            return pd.read_csv(files[0], **kwargs)
+        workers = workers or min(len(files), os.cpu_count() or 1)
+        DEBUG("Reading %d data files on %d threads", len(files), workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            frames = list(executor.map(lambda filepath: pd.read_csv(filepath, **kwargs), files))
+        return pd.concat(frames, ignore_index=True)
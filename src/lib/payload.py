@@ -0,0 +1,85 @@
+"""Pre-aggregated JSON payloads of the charts.
+
+Instead of a rendered image, a chart can be written out as the series it
+plots, which lib/assets/charts.js draws in the browser. A payload is built
+from the count cube alone, following the kind of the chart:
+
+{
+  "name": "fatalities_by_state_compare", "kind": "bar", "field": "state",
+  "title": "...", "x_label": "State", "y_label": "Road Fatalities",
+  "labels": ["ACT", "NSW", ...],
+  "series": [{"name": "2015", "values": [4, 310, ...]}, ...]
+}
+
+Histograms are sent as the counts of bins of Constants.STEP_SIZE, labelled
+by the lower edge of each bin, with "bin_size" set. Their series also carry
+the quartiles of the values, eg: "quartiles": [33, 55, 78].
+"""
+import pandas as pd
+
+from lib.cube import COUNT_COLUMN
+import lib.constants as Constants
+from lib.distribution import Distribution
+from lib.schema import value_sort_key
+import lib.utils as Utils
+
+
+def _labels(field, series_list):
+    values = set()
+    for series in series_list:
+        values.update(series.index)
+    return sorted(values, key=value_sort_key(field))
+
+
+def build(spec, cube, start_year=None, end_year=None):
+    """Builds the payload of a chart.
+
+    Args:
+      spec (registry.ChartSpec): Chart to build the payload of
+      cube (CountCube): Counts the chart is drawn from
+      start_year (int): First compare year, for compare charts
+      end_year (int): Second compare year, for compare charts
+
+    Returns: dict of the payload
+    """
+    field = spec.field
+    if spec.compare:
+        series = [(str(year), cube.for_year(field, year)) for year in (start_year, end_year)]
+        title = "Comparison statistics of %s between %s and %s" % (
+            field.replace("_", " "), start_year, end_year)
+    else:
+        totals = cube.year_totals() if field == "year" else cube.totals(field)
+        series = [(COUNT_COLUMN, totals)]
+        title = "Impact of %s over years" % field.replace("_", " ")
+    payload = {
+        "name": spec.name,
+        "kind": spec.kind,
+        "field": field,
+        "title": title,
+        "x_label": field.replace("_", " ").capitalize(),
+        "y_label": COUNT_COLUMN
+    }
+    if spec.kind == "histogram":
+        return _histogram(payload, series)
+    labels = _labels(field, [counts for _, counts in series])
+    index = pd.Index(labels)
+    payload["labels"] = [Utils.to_builtin(label) for label in labels]
+    payload["series"] = [{"name": name,
+                          "values": [int(value) for value in counts.reindex(index, fill_value=0)]}
+                         for name, counts in series]
+    return payload
+
+
+def _histogram(payload, series):
+    step = Constants.STEP_SIZE
+    distributions = [(name, Distribution.from_counts(counts)) for name, counts in series]
+    # Every series is binned up to the highest value of any of them
+    top = max([int(dist.values.max()) for _, dist in distributions if dist.total] or [0])
+    payload["bin_size"] = step
+    payload["series"] = []
+    for name, dist in distributions:
+        edges, counts = dist.histogram(step, top=top)
+        payload["series"].append({"name": name, "values": [int(count) for count in counts],
+                                  "quartiles": [dist.quantile(q) for q in (0.25, 0.5, 0.75)]})
+    payload["labels"] = [int(edge) for edge in edges[:-1]]
+    return payload
@@ -0,0 +1,91 @@
+"""Registry of the charts generated for the website.
+
+Chart methods are registered with the chart() decorator, which declares the
+name of the chart, the field it is about, its kind and the cube fields it is
+drawn from. The html page group of a chart follows from its field and
+Constants.GROUPS.
+"""
+from collections import OrderedDict, namedtuple
+
+import lib.constants as Constants
+
+ChartSpec = namedtuple("ChartSpec", ["name", "field", "kind", "depends", "group", "method",
+                                     "compare"])
+ChartSpec.payload_file = property(lambda spec: spec.name + ".json")
+
+CHARTS = OrderedDict()
+
+KINDS = ("line", "bar", "pie", "histogram")
+
+
+def group_name(grp):
+    return "_".join(grp)
+
+
+def group_of(field):
+    for grp in Constants.GROUPS:
+        if field in grp:
+            return group_name(grp)
+    raise ValueError("Field %s is not part of any group" % field)
+
+
+def chart(name, field, kind, depends=None, compare=False):
+    """Registers the decorated method as the chart with the given name.
+
+    Args:
+      name (str): Chart name, which is also the name of its output file
+      field (str): Field the chart is about
+      kind (str): Kind of chart, one of KINDS
+      depends (list): Cube fields the chart is drawn from. Defaults to [field]
+      compare (bool): The chart compares the compare start and end years
+    """
+    if kind not in KINDS:
+        raise ValueError("Unknown kind %s of chart %s" % (kind, name))
+
+    def register(method):
+        CHARTS[name] = ChartSpec(name=name, field=field, kind=kind,
+                                 depends=tuple(
+                                     [field] if depends is None else depends),
+                                 group=group_of(field), method=method.__name__,
+                                 compare=compare)
+        return method
+    return register
+
+
+def get(name):
+    return CHARTS[name]
+
+
+def select(charts=None, groups=None):
+    """Selects the registered charts by name, field or group.
+
+    Args:
+      charts (list): Chart names or fields, eg: ['state', 'fatalities_by_hour']
+      groups (list): Group names, eg: ['dayweek_hour_year']
+
+    Returns: List of ChartSpec in registration order, all of them when
+             neither charts nor groups are given
+
+    Raises: ValueError for unknown charts or groups
+    """
+    if not charts and not groups:
+        return list(CHARTS.values())
+    charts, groups = set(charts or ()), set(groups or ())
+    known_groups = set(group_name(grp) for grp in Constants.GROUPS)
+    unknown = [group for group in groups if group not in known_groups]
+    if unknown:
+        raise ValueError("Unknown group(s) %s, expected one of %s" %
+                         (", ".join(sorted(unknown)), ", ".join(sorted(known_groups))))
+    unknown = [name for name in charts if name not in CHARTS and
+               not any(spec.field == name for spec in CHARTS.values())]
+    if unknown:
+        raise ValueError("Unknown chart(s) %s, expected chart names or fields among %s" %
+                         (", ".join(sorted(unknown)), ", ".join(CHARTS)))
+    return [spec for spec in CHARTS.values()
+            if spec.name in charts or spec.field in charts or spec.group in groups]
+
+
+def required_fields(specs):
+    """Returns: Cube fields the given charts are drawn from"""
+    fields = set(field for spec in specs for field in spec.depends)
+    return [field for field in Constants.CUBE_FIELDS if field in fields]
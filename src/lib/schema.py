@@ -0,0 +1,82 @@
+"""Compact typed representation of the processed fatalities data.
+
+Text columns with few distinct values become categoricals with the fixed
+category orders declared in Constants.CATEGORIES, yes/no columns become
+booleans and integer columns are downcast to the smallest width holding
+their values.
+"""
+import pandas as pd
+
+import lib.constants as Constants
+
+
+def categories_of(field, values=()):
+    """Declared categories of field followed by any other given values.
+
+    Args:
+      field (str): Column name
+      values (iterable): Values seen in the data
+
+    Returns: List of categories
+    """
+    declared = list(Constants.CATEGORIES.get(field, ()))
+    known = set(declared)
+    return declared + sorted(set(value for value in values if value not in known))
+
+
+def value_sort_key(field):
+    """Sort key ordering the values of field like its categories"""
+    order = {value: position for position, value in enumerate(
+        Constants.CATEGORIES.get(field, ()))}
+    return lambda value: (order.get(value, len(order)), value)
+
+
+def _downcast(series):
+    return pd.to_numeric(series, downcast='unsigned' if series.min() >= 0 else 'integer')
+
+
+def compact_frame(df):
+    """Converts a processed frame to the compact schema.
+
+    Values outside the declared categories are kept as extra categories
+    rather than being turned into missing values.
+
+    Args:
+      df (pandas.DataFrame): Processed fatalities data
+
+    Returns: A new DataFrame
+    """
+    columns = {}
+    for name in df.columns:
+        series = df[name]
+        if name in Constants.CATEGORIES or name in Constants.CATEGORICAL_COLUMNS:
+            columns[name] = pd.Categorical(
+                series, categories=categories_of(name, series.unique()))
+        elif name in Constants.BOOLEAN_COLUMNS and series.dtype != bool:
+            columns[name] = series == 'yes'
+        elif pd.api.types.is_integer_dtype(series.dtype) and len(series):
+            columns[name] = _downcast(series)
+    return df.assign(**columns)
+
+
+def memory_report(before, after):
+    """Formats the per column memory footprint of two versions of a frame.
+
+    Args:
+      before (pandas.DataFrame): Frame before compaction
+      after (pandas.DataFrame): Frame after compaction
+
+    Returns: Report as a multi line string
+    """
+    before_usage = before.memory_usage(deep=True, index=False)
+    after_usage = after.memory_usage(deep=True, index=False)
+    lines = ["%-32s %-10s %12s   %-10s %12s" %
+             ("Column", "Dtype", "Bytes", "Dtype", "Bytes")]
+    for name in after.columns:
+        lines.append("%-32s %-10s %12d   %-10s %12d" % (
+            name, before[name].dtype, before_usage[name], after[name].dtype, after_usage[name]))
+    total_before, total_after = before_usage.sum(), after_usage.sum()
+    lines.append("%-32s %-10s %12d   %-10s %12d (%.1fx smaller)" % (
+        "Total", "", total_before, "", total_after, total_before / max(total_after, 1)))
+    return "\n".join(lines)
+
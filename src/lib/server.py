@@ -0,0 +1,319 @@
+"""Local preview server of the generated website.
+
+An asyncio HTTP/1.1 server that serves the static/ tree under /static/, the
+directory of the data file under /data/ so that the download links work, and
+a query API answered from the processed fatalities data held in memory:
+
+  /api/fields
+      The queryable fields along with the values of the categorical ones.
+  /api/counts?field=state&year=2019&group_by=gender
+      Fatalities counted by field, and by group_by when given. Any other
+      parameter naming a field filters the rows on its comma separated
+      values, eg: year=2019,2020&road_user=Driver
+
+Answers are computed on a thread pool, leaving the event loop free to serve
+other requests, and the serialized answers of the most recent distinct
+queries are kept in an LRU cache. Nothing is fetched from the network.
+"""
+import asyncio
+import json
+import mimetypes
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from lib.logger import INFO, LOGEXCEPTION
+from lib.schema import value_sort_key
+import lib.utils as Utils
+
+# Seconds an idle keep-alive connection is held open
+KEEP_ALIVE_TIMEOUT = 5
+REASONS = {200: "OK", 302: "Found", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 500: "Internal Server Error"}
+TRUE_VALUES = ("yes", "true", "1")
+FALSE_VALUES = ("no", "false", "0")
+
+
+class QueryError(ValueError):
+    """Invalid query parameters, answered with a 400"""
+
+
+def _to_json_bytes(obj):
+    return json.dumps(obj, sort_keys=True).encode("utf-8")
+
+
+class CountsQuery(object):
+    def __init__(self, df, cache_size=256):
+        """
+        Args:
+          df (pandas.DataFrame): Processed fatalities data
+          cache_size (int): Number of distinct query answers kept in memory
+        """
+        self.df = df
+        self.fields = [name for name in df.columns if name != "id"]
+        self._cached_counts = lru_cache(maxsize=cache_size)(self._counts)
+
+    def _check_field(self, name, parameter):
+        if name not in self.fields:
+            raise QueryError("Unknown %s %r, expected one of: %s" % (
+                parameter, name, ", ".join(self.fields)))
+
+    def _parse_value(self, field, text):
+        dtype = self.df[field].dtype
+        if pd.api.types.is_bool_dtype(dtype):
+            if text.lower() in TRUE_VALUES:
+                return True
+            if text.lower() in FALSE_VALUES:
+                return False
+            raise QueryError("%s takes yes or no, got %r" % (field, text))
+        if pd.api.types.is_integer_dtype(dtype):
+            try:
+                return int(text)
+            except ValueError:
+                raise QueryError("%s takes integers, got %r" % (field, text))
+        return text
+
+    def parse(self, params):
+        """Normalizes query parameters, so that equivalent queries share
+        their cache entry.
+
+        Args:
+          params (dict): Parsed query string, lists of values by name
+
+        Returns: (field, group_by, filters) with filters a sorted tuple of
+                 (field, sorted tuple of values)
+
+        Raises: QueryError on unknown fields or malformed values
+        """
+        field = (params.get("field") or [None])[-1]
+        if not field:
+            raise QueryError("Missing the field parameter")
+        self._check_field(field, "field")
+        group_by = (params.get("group_by") or [None])[-1] or None
+        if group_by is not None:
+            self._check_field(group_by, "group_by")
+            if group_by == field:
+                raise QueryError("group_by has to differ from field")
+        filters = []
+        for name, texts in params.items():
+            if name in ("field", "group_by"):
+                continue
+            self._check_field(name, "filter")
+            values = set()
+            for text in texts:
+                values.update(self._parse_value(name, item.strip())
+                              for item in text.split(",") if item.strip())
+            filters.append((name, tuple(sorted(values))))
+        return field, group_by, tuple(sorted(filters))
+
+    def _counts(self, field, group_by, filters):
+        df = self.df
+        if filters:
+            mask = np.ones(len(df), dtype=bool)
+            for name, values in filters:
+                mask &= df[name].isin(values).to_numpy()
+            df = df[mask]
+        keys = [field] if group_by is None else [field, group_by]
+        counts = df.groupby(keys, observed=True, sort=False).size()
+        rows = []
+        for values, count in counts.items():
+            values = values if group_by is not None else (values,)
+            row = {key: Utils.to_builtin(value) for key, value in zip(keys, values)}
+            row["count"] = int(count)
+            rows.append(row)
+        sort_keys = [value_sort_key(key) for key in keys]
+        rows.sort(key=lambda row: [sort_key(row[key]) for key, sort_key in zip(keys, sort_keys)])
+        return _to_json_bytes({
+            "field": field,
+            "group_by": group_by,
+            "filters": {name: [Utils.to_builtin(value) for value in values]
+                        for name, values in filters},
+            "total": int(counts.sum()),
+            "counts": rows
+        })
+
+    def counts(self, params):
+        """Answers a /api/counts query.
+
+        Args:
+          params (dict): Parsed query string, lists of values by name
+
+        Returns: The answer serialized as JSON bytes
+
+        Raises: QueryError on invalid parameters
+        """
+        return self._cached_counts(*self.parse(params))
+
+    def describe(self):
+        """Answers a /api/fields query"""
+        fields = {}
+        for name in self.fields:
+            series = self.df[name]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                values = [str(value) for value in series.cat.categories]
+            elif pd.api.types.is_bool_dtype(series.dtype):
+                values = ["yes", "no"]
+            else:
+                values = None
+            fields[name] = {"dtype": str(series.dtype), "values": values}
+        return _to_json_bytes({"fields": fields})
+
+
+class PreviewServer(object):
+    def __init__(self, mounts, query, workers=None):
+        """
+        Args:
+          mounts (dict): Directory served under each url prefix, eg:
+                         {"/static/": "/site/static"}
+          query (CountsQuery): Answers the api requests
+          workers (int): Threads computing the answers and reading the
+                         files. Defaults to the ThreadPoolExecutor default
+        """
+        self.mounts = [(prefix, os.path.realpath(directory))
+                       for prefix, directory in mounts.items()]
+        self.query = query
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._fields = None
+
+    def resolve(self, path):
+        """Maps a url path to the file it serves.
+
+        Returns: Absolute file path, None when the path is not served
+        """
+        if "\x00" in path:
+            return None
+        for prefix, directory in self.mounts:
+            if not path.startswith(prefix):
+                continue
+            filepath = os.path.realpath(os.path.join(directory, path[len(prefix):]))
+            # Keep ../ and symlinks from escaping the served directory
+            if filepath != directory and not filepath.startswith(directory + os.sep):
+                return None
+            if os.path.isdir(filepath):
+                filepath = os.path.join(filepath, "index.html")
+            return filepath
+        return None
+
+    async def _api(self, path, query_string):
+        loop = asyncio.get_running_loop()
+        params = parse_qs(query_string, keep_blank_values=False)
+        if path == "/api/fields":
+            if self._fields is None:
+                self._fields = await loop.run_in_executor(self.executor, self.query.describe)
+            return 200, "application/json", self._fields
+        if path == "/api/counts":
+            try:
+                body = await loop.run_in_executor(self.executor, self.query.counts, params)
+            except QueryError as ex:
+                return 400, "application/json", _to_json_bytes({"error": str(ex)})
+            return 200, "application/json", body
+        return 404, "application/json", _to_json_bytes({"error": "Unknown endpoint %s" % path})
+
+    async def _file(self, path):
+        filepath = self.resolve(path)
+        if filepath is None or not Utils.file_exists(filepath):
+            return 404, "text/plain", b"Not found"
+        loop = asyncio.get_running_loop()
+        with open(filepath, "rb") as fh:
+            body = await loop.run_in_executor(self.executor, fh.read)
+        content_type = mimetypes.guess_type(filepath)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type.endswith("javascript"):
+            content_type += "; charset=utf-8"
+        return 200, content_type, body
+
+    async def respond(self, method, target):
+        """Builds the response to a request.
+
+        Returns: (status, headers dict, body bytes)
+        """
+        if method not in ("GET", "HEAD"):
+            return 405, {"Allow": "GET, HEAD", "Content-Type": "text/plain"}, b"Method not allowed"
+        url = urlsplit(target)
+        path = unquote(url.path)
+        if path == "/":
+            return 302, {"Location": "/static/index.html"}, b""
+        if path.startswith("/api/"):
+            status, content_type, body = await self._api(path, url.query)
+        else:
+            status, content_type, body = await self._file(path)
+        # Pages change on every regeneration, always check with the server
+        return status, {"Content-Type": content_type, "Cache-Control": "no-cache"}, body
+
+    async def _read_request(self, reader):
+        request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+        if not request_line:
+            return None
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return request_line.decode("latin-1").split(), headers
+
+    async def handle(self, reader, writer):
+        """Serves the requests of a connection until it is closed"""
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                parts, request_headers = request
+                if len(parts) != 3:
+                    status, headers, body = 400, {"Content-Type": "text/plain"}, b"Bad request"
+                    method, keep_alive = None, False
+                else:
+                    method, target, version = parts
+                    try:
+                        status, headers, body = await self.respond(method, target)
+                    except Exception:
+                        LOGEXCEPTION("Failed to answer %s %s", method, target)
+                        status, headers, body = 500, {"Content-Type": "text/plain"}, b"Server error"
+                    INFO("%s %s %d", method, target, status)
+                    keep_alive = (version == "HTTP/1.1" and
+                                  request_headers.get("connection", "").lower() != "close")
+                lines = ["HTTP/1.1 %d %s" % (status, REASONS[status])]
+                lines.extend("%s: %s" % item for item in headers.items())
+                lines.append("Content-Length: %d" % len(body))
+                lines.append("Connection: %s" % ("keep-alive" if keep_alive else "close"))
+                writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+                if method != "HEAD":
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            # Idle, dropped or with a request line over the reader limit
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port, started=None):
+        """Serves until cancelled.
+
+        Args:
+          host (str): Address to listen on
+          port (int): Port to listen on, 0 picks a free one
+          started (callable): Called with the listening (host, port)
+        """
+        server = await asyncio.start_server(self.handle, host, port)
+        address = server.sockets[0].getsockname()[:2]
+        INFO("Serving the website on http://%s:%d/", *address)
+        if started is not None:
+            started(address)
+        async with server:
+            await server.serve_forever()
+
+    def run(self, host, port):
+        """Serves until interrupted"""
+        try:
+            asyncio.run(self.serve(host, port))
+        except KeyboardInterrupt:
+            INFO("Stopped the preview server")
+        finally:
+            self.executor.shutdown(wait=False)
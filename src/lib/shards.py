@@ -0,0 +1,198 @@
+"""Splitting one build of the website across several shards.
+
+A build with --shard K/N lists the chart outputs and html pages the whole
+build generates, in a fixed order called the plan, and only generates the
+ones at the positions p of the plan with p % N == K - 1. The plan follows
+from the data and the arguments alone, so every shard of a build comes up
+with the same plan and together they generate each of its outputs once.
+Each shard records the files it generated in a manifest under
+Constants.RELATIVE_SHARDS_DIR of the output directory.
+
+Once the output directories of all the shards are copied into one, merge()
+checks the manifests against each other and against the files, then writes
+what no single shard can: the charts manifest of the build cache covering
+all the charts, and index.html.
+"""
+import glob
+import hashlib
+import os
+from collections import defaultdict, namedtuple
+
+from lib.build_cache import BuildCache
+from lib.logger import INFO
+import lib.constants as Constants
+import lib.templates as templates
+import lib.utils as Utils
+
+MANIFEST_VERSION = 1
+CHART_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "charts.js")
+
+
+class MergeError(ValueError):
+    """The manifests of the shards do not add up to a complete build"""
+
+    def __init__(self, problems):
+        super(MergeError, self).__init__("Can not merge the shards:\n  " + "\n  ".join(problems))
+        self.problems = problems
+
+
+def chart_unit(chart_key):
+    return "chart:" + chart_key
+
+
+def page_unit(relative_path):
+    return "page:" + relative_path.replace(os.sep, "/")
+
+
+class Shard(namedtuple("Shard", ["index", "count"])):
+    @classmethod
+    def parse(cls, value):
+        """
+        Args:
+          value (str): K/N, shard K of N with K from 1 to N
+
+        Returns: Shard object
+
+        Raises: ValueError when value is not of that form
+        """
+        try:
+            index, count = [int(part) for part in value.split("/")]
+        except ValueError:
+            raise ValueError("expected K/N, eg: 1/4, got %s" % value)
+        if not 1 <= index <= count:
+            raise ValueError("expected K/N with K from 1 to N, got %s" % value)
+        return cls(index, count)
+
+    def __str__(self):
+        return "%d/%d" % (self.index, self.count)
+
+    @property
+    def manifest_name(self):
+        return "shard-%d-of-%d.json" % (self.index, self.count)
+
+    def owns(self, position):
+        return position % self.count == self.index - 1
+
+
+class ShardPlan(object):
+    def __init__(self, shard, units):
+        """
+        Args:
+          shard (Shard): Shard of the build run by this process
+          units (list): Outputs of the whole build, see chart_unit() and
+                        page_unit(), in the order they are generated in
+        """
+        self.shard = shard
+        self.units = list(units)
+        self.owned = [unit for position, unit in enumerate(self.units) if shard.owns(position)]
+        self._owned = set(self.owned)
+        self.digest = hashlib.sha256("\n".join(self.units).encode()).hexdigest()
+
+    def owns(self, unit):
+        return unit in self._owned
+
+    def write_manifest(self, output_dir, files, charts, site):
+        """Records the outputs generated by the shard.
+
+        Args:
+          output_dir (str): Output directory of the build
+          files (dict): Map of each owned unit to the files it was written
+                        as, relative to output_dir
+          charts (dict): Map of chart key to the fingerprint and image
+                         variants of each owned chart, for the build cache
+          site (dict): What merge() needs to write index.html
+
+        Returns: Path of the manifest
+        """
+        filepath = os.path.join(output_dir, Constants.RELATIVE_SHARDS_DIR, self.shard.manifest_name)
+        Utils.write_to_file(filepath, Utils.to_json({
+            "version": MANIFEST_VERSION,
+            "shard": list(self.shard),
+            "plan": self.digest,
+            "expected": self.units,
+            "files": files,
+            "charts": charts,
+            "site": site
+        }))
+        INFO("Shard %s generated %d of the %d outputs of the build, see %s",
+             self.shard, len(self.owned), len(self.units), filepath)
+        return filepath
+
+
+def _check(manifests, output_dir):
+    """Returns: List of the problems found with the manifests"""
+    problems = []
+    first_path, first = manifests[0]
+    count = first["shard"][1]
+    indexes = defaultdict(list)
+    producers = defaultdict(list)
+    for path, manifest in manifests:
+        if manifest["plan"] != first["plan"] or manifest["shard"][1] != count:
+            problems.append("%s is of another build than %s, which was run with other "
+                            "arguments, data or number of shards" % (path, first_path))
+            continue
+        indexes[manifest["shard"][0]].append(path)
+        for unit, files in manifest["files"].items():
+            producers[unit].append(path)
+            problems.extend("%s of %s is missing" % (relative_path, unit) for relative_path in files
+                            if not Utils.file_exists(os.path.join(output_dir, relative_path)))
+    problems.extend("Shard %d/%d has several manifests: %s" % (index, count, ", ".join(paths))
+                    for index, paths in sorted(indexes.items()) if len(paths) > 1)
+    problems.extend("Shard %d/%d has no manifest" % (index, count)
+                    for index in range(1, count + 1) if index not in indexes)
+    expected = set(first["expected"])
+    for unit in first["expected"]:
+        if not producers.get(unit):
+            problems.append("%s was not generated by any shard" % unit)
+        elif len(producers[unit]) > 1:
+            problems.append("%s was generated by several shards: %s" % (unit, ", ".join(producers[unit])))
+    problems.extend("%s is not part of the build" % unit for unit in producers if unit not in expected)
+    return problems
+
+
+def merge(output_dir, manifest_paths=None):
+    """Completes a build run as several shards.
+
+    Args:
+      output_dir (str): Directory holding the outputs of all the shards
+      manifest_paths (list): Manifests of the shards. Defaults to all the
+                             manifests under the shards directory
+
+    Raises: MergeError when the shards do not add up to the whole build
+    """
+    if not manifest_paths:
+        manifest_paths = sorted(glob.glob(os.path.join(output_dir, Constants.RELATIVE_SHARDS_DIR, "*.json")))
+    if not manifest_paths:
+        raise MergeError(["No shard manifests found under %s" % os.path.join(
+            output_dir, Constants.RELATIVE_SHARDS_DIR)])
+    manifests = []
+    for path in manifest_paths:
+        manifest = Utils.read_json(path)
+        if not manifest or manifest.get("version") != MANIFEST_VERSION:
+            raise MergeError(["%s is not a shard manifest of this version" % path])
+        manifests.append((path, manifest))
+    problems = _check(manifests, output_dir)
+    if problems:
+        raise MergeError(problems)
+
+    build_cache = BuildCache(os.path.join(output_dir, Constants.RELATIVE_CHARTS_MANIFEST))
+    for _, manifest in manifests:
+        build_cache.update(dict((key, chart["fingerprint"]) for key, chart in manifest["charts"].items()),
+                           dict((key, chart["outputs"]) for key, chart in manifest["charts"].items()))
+    build_cache.save()
+
+    site = manifests[0][1]["site"]
+    static_dir = os.path.join(output_dir, "static")
+    if site["output_format"] == "json":
+        Utils.write_to_file(os.path.join(output_dir, Constants.RELATIVE_CHART_SCRIPT),
+                            Utils.read_file(CHART_SCRIPT), only_if_changed=True)
+    links = templates.navigation(
+        static_dir, static_dir, site["groups"],
+        [(os.path.join(output_dir, path), name) for path, name in site["data_files"]],
+        [(os.path.join(output_dir, path), state) for path, state in site["state_pages"]],
+        site["compare_page"] and os.path.join(output_dir, site["compare_page"]))
+    filepath = os.path.join(static_dir, "index.html")
+    Utils.write_to_file(filepath, templates.create_environment().get_template("index.html").render(**links),
+                        only_if_changed=True)
+    INFO("Merged the %d outputs of %d shards and generated %s",
+         len(manifests[0][1]["expected"]), len(manifests), filepath)
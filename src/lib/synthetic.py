@@ -0,0 +1,81 @@
+"""Synthetic fatalities data for benchmarking.
+
+Generates data files of any size with the schema of data/traffic.csv. Each
+column is sampled independently from the distribution of its values in a
+profile data file (data/traffic.csv by default), which keeps the states,
+crash types, road users, ages, HH:MM times, years after
+Constants.STARTING_YEAR etc. realistic.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from lib.logger import INFO
+import lib.constants as Constants
+
+CHUNK_SIZE = 500000
+
+
+class Profile(object):
+    def __init__(self, columns, distributions):
+        """
+        Args:
+          columns (list): Columns of the data file in order
+          distributions (dict): Map of column to a Series of value probabilities
+        """
+        self.columns = columns
+        self.distributions = distributions
+
+    @classmethod
+    def from_csv(cls, filepath):
+        df = pd.read_csv(filepath)
+        df = df[df['year'] > Constants.STARTING_YEAR].dropna()
+        time = df['time'].astype(str).str.split(':', n=1, expand=True).astype(int)
+        distributions = {column: df[column].value_counts(normalize=True)
+                         for column in df.columns if column not in ('id', 'time')}
+        distributions['hour'] = time[0].value_counts(normalize=True)
+        distributions['minutes'] = time[1].value_counts(normalize=True)
+        return cls(list(df.columns), distributions)
+
+    def sample(self, name, rng, rows):
+        distribution = self.distributions[name]
+        return rng.choice(distribution.index.values, size=rows, p=distribution.values)
+
+
+def generate(rows, profile, seed=0, chunk_size=CHUNK_SIZE):
+    """Generates synthetic rows chunk by chunk.
+
+    Args:
+      rows (int): Number of rows to generate
+      profile (Profile): Value distributions to sample from
+      seed (int): Random seed, the same seed gives the same data
+      chunk_size (int): Maximum rows per chunk
+
+    Yields: DataFrame chunks with the columns of the profile
+    """
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, chunk_size):
+        size = min(chunk_size, rows - start)
+        chunk = {}
+        for column in profile.columns:
+            if column == 'id':
+                chunk[column] = rng.integers(10000000, 100000000, size=size)
+            elif column == 'time':
+                hours = pd.Series(profile.sample('hour', rng, size)).astype(str)
+                minutes = pd.Series(profile.sample('minutes', rng, size)).astype(str).str.zfill(2)
+                chunk[column] = hours.str.cat(minutes, sep=':').values
+            else:
+                chunk[column] = profile.sample(column, rng, size)
+        yield pd.DataFrame(chunk, columns=profile.columns)
+
+
+def write_csv(filepath, rows, profile, seed=0):
+    """Writes a synthetic data file of the given number of rows"""
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    tmp_path = filepath + ".tmp"
+    pd.DataFrame(columns=profile.columns).to_csv(tmp_path, index=False)
+    for chunk in generate(rows, profile, seed=seed):
+        chunk.to_csv(tmp_path, mode='a', header=False, index=False)
+    os.replace(tmp_path, filepath)
+    INFO("Generated %d synthetic rows in %s", rows, filepath)
@@ -0,0 +1,63 @@
+"""Jinja templates of the html pages, kept under lib/assets/templates.
+
+Every page extends base.html, which holds the page head and the navigation
+bar. Templates are compiled once per process, when first rendered, and
+their compiled bytecode is cached on disk so that later runs load it rather
+than compiling the templates again. The bytecode of a template is
+invalidated whenever its source changes.
+"""
+import os
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+import lib.constants as Constants
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "templates")
+
+
+def create_environment(cache_dir=None):
+    """Creates the environment the pages are rendered with.
+
+    Args:
+      cache_dir (str): Directory the compiled templates are cached in.
+                       Defaults to None, which does not cache them on disk
+
+    Returns: jinja2.Environment object
+    """
+    bytecode_cache = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    # The templates do not change while the website is generated, so the
+    # files are not checked for changes on every render
+    env = Environment(loader=FileSystemLoader(TEMPLATES_DIR), bytecode_cache=bytecode_cache,
+                      keep_trailing_newline=True, auto_reload=False)
+    return env
+
+
+def navigation(static_dir, page_dir, group_names, data_files, state_pages, compare_page=None):
+    """Links of the navigation bar of base.html, relative to the page.
+
+    Args:
+      static_dir (str): Directory of index.html
+      page_dir (str): Directory of the page
+      group_names (list): Names of the generated group pages, see
+                          registry.group_name()
+      data_files (list): (path, name) tuples of the data files
+      state_pages (list): (path, state) tuples of the state pages
+      compare_page (str): Path of compare.html, if generated
+
+    Returns: dict of the root, group_titles, data_links, state_links and
+             compare_link template variables
+    """
+    root = "" if page_dir == static_dir else os.path.relpath(static_dir, page_dir) + "/"
+    return {
+        "root": root,
+        "group_titles": [(name, Constants.GROUP_TITLES[name]) for name in group_names],
+        "data_links": [(os.path.relpath(path, page_dir).replace(os.sep, "/"), name)
+                       for path, name in data_files],
+        "state_links": [(os.path.relpath(path, page_dir).replace(os.sep, "/"), state)
+                        for path, state in state_pages],
+        "compare_link": (os.path.relpath(compare_page, page_dir).replace(os.sep, "/")
+                         if compare_page else None)
+    }
@@ -1,23 +1,85 @@
-import inspect
+import json
 import os
+import uuid
+
+import numpy as np
 
 
 def get_project_dir():
     return os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 
-def get_caller_name(level=1):
-    frame = inspect.currentframe()
-    for _ in range(level):
-        frame = frame.f_back
-    return frame.f_code.co_name
+def file_exists(filepath):
+    return os.path.isfile(filepath)
+
+
+def read_file(filepath, default=None):
+    try:
+        with open(filepath, 'r') as fh:
+            return fh.read()
+    except (IOError, OSError):
+        return default
+
+
+def read_json(filepath, default=None):
+    content = read_file(filepath)
+    if content is None:
+        return default
+    try:
+        return json.loads(content)
+    except ValueError:
+        return default
+
+
+def to_builtin(value):
+    """Converts numpy scalars to the equivalent python objects"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def to_json(obj):
+    return json.dumps(obj, indent=2, sort_keys=True)
+
+
+def _has_content(filepath, data):
+    try:
+        # Files of another size can not match, which spares reading them
+        if os.path.getsize(filepath) != len(data):
+            return False
+        with open(filepath, 'rb') as fh:
+            return fh.read() == data
+    except (IOError, OSError):
+        return False
+
 
+def write_to_file(filepath, content, only_if_changed=False):
+    """Writes content to filepath, creating the parent directories as needed.
 
-def get_all_method_names(cls):
-    return [attr for attr in dir(cls) if not attr.startswith("__") and callable(getattr(cls, attr))]
+    The content is written to a temporary file in the same directory which
+    is then renamed over filepath, so that readers never see a partially
+    written file.
 
+    Args:
+      filepath (str): Path of the file to write
+      content (object): Content to be written, converted with str()
+      only_if_changed (bool): Leave the file, along with its modification
+                              time, untouched when it already has the same
+                              content
 
-def write_to_file(filepath, content):
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    with open(filepath, 'w') as fh:
-        fh.write(str(content))
+    Returns: True if the file was written, False otherwise
+    """
+    data = str(content).encode("utf-8")
+    if only_if_changed and _has_content(filepath, data):
+        return False
+    directory = os.path.dirname(filepath)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, ".%s.%s.tmp" % (os.path.basename(filepath), uuid.uuid4().hex))
+    try:
+        # Created with the default permissions, unlike tempfile's files
+        with open(tmp_path, 'xb') as fh:
+            fh.write(data)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
@@ -0,0 +1,200 @@
+"""Validation of the rows of the data file against the declared schema.
+
+Every column is checked once, with column-wise operations only. Text
+columns are checked through their distinct values, which are few, and the
+verdicts are mapped back onto the rows through the factorized codes. A row
+failing any check is quarantined: it is left out of the charts and written
+to the quarantine file along with the reason codes of the checks it failed.
+
+Reason codes:
+  missing_<column>       The value is missing
+  not_integer_<column>   A whole number column holds anything else
+  out_of_range_<column>  The value is outside Constants.VALID_RANGES
+  bad_time_format        time is not HH:MM
+  unknown_<column>       The value is not among the declared categories
+"""
+import os
+import re
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from lib.logger import INFO, WARN
+import lib.constants as Constants
+import lib.utils as Utils
+
+REASONS_COLUMN = "reasons"
+
+
+def _by_distinct_values(series, check):
+    """Applies check to the distinct values of series only.
+
+    Args:
+      series (pandas.Series): Column without missing values
+      check (callable): Takes an array of the distinct values, returns an
+                        array of booleans
+
+    Returns: numpy array of the verdict of each row
+    """
+    codes, uniques = pd.factorize(series)
+    return np.asarray(check(np.asarray(uniques, dtype=object)), dtype=bool)[codes]
+
+
+def _as_written(rows):
+    """Rows with the whole numbers of their float columns as integers.
+
+    Columns with missing values are read as floats, and a chunk of the data
+    file may hold none of them, so the same value is read as 40 or 40.0
+    depending on the rest of its column. Writing whole numbers back as
+    integers gives the values as written in the data file whichever way
+    they were read.
+    """
+    columns = {}
+    for column in rows.columns:
+        series = rows[column]
+        if series.dtype.kind != "f":
+            continue
+        whole = series.notna().to_numpy() & (series.to_numpy() == np.floor(series.to_numpy()))
+        written = series.astype(object)
+        written[whole] = series[whole].astype(np.int64).astype(object)
+        columns[column] = written
+    return rows.assign(**columns) if columns else rows
+
+
+def validate(df):
+    """Checks each row of a frame read from the data file.
+
+    Args:
+      df (pandas.DataFrame): Rows as read from the data file
+
+    Returns: dict of reason code to a numpy array of booleans, True for the
+             rows failing that check
+
+    Raises: ValueError when a column is missing altogether
+    """
+    absent = [column for column in Constants.INPUT_DTYPES if column not in df.columns]
+    if absent:
+        raise ValueError("The data file lacks the columns %s" % ", ".join(absent))
+    failures = {}
+    present = {}
+    for column in Constants.INPUT_DTYPES:
+        missing = df[column].isna().to_numpy()
+        failures["missing_" + column] = missing
+        present[column] = ~missing
+    for column in Constants.INTEGER_COLUMNS:
+        values = pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=np.float64)
+        with np.errstate(invalid="ignore"):
+            failures["not_integer_" + column] = present[column] & (
+                np.isnan(values) | (values != np.floor(values)))
+            if column in Constants.VALID_RANGES:
+                low, high = Constants.VALID_RANGES[column]
+                failures["out_of_range_" + column] = (values < low) | (values > high)
+    pattern = re.compile(Constants.VALID_TIME_PATTERN)
+    failures["bad_time_format"] = present["time"] & _by_distinct_values(
+        df["time"].astype(str), lambda values: [pattern.match(value) is None for value in values])
+    for column in Constants.CLOSED_CATEGORY_COLUMNS + Constants.INVOLVEMENT_COLUMNS:
+        allowed = Constants.CATEGORIES.get(column, Constants.YES_NO_VALUES)
+        failures["unknown_" + column] = present[column] & ~df[column].isin(allowed).to_numpy()
+    return failures
+
+
+def rejected_rows(failures, length):
+    """Rows failing any check, as a numpy array of booleans"""
+    rejected = np.zeros(length, dtype=bool)
+    for failed in failures.values():
+        rejected |= failed
+    return rejected
+
+
+class Quarantine(object):
+    def __init__(self, filepath):
+        """
+        Args:
+          filepath (str): csv file the rejected rows are written to. None
+                          only counts them
+        """
+        self.filepath = filepath
+        self.counts = {}
+        self.rows = 0
+        self._write_header = True
+        self._kept = None
+
+    def start(self, append=False, keep=False):
+        """Starts over, for another read of the data file.
+
+        Args:
+          append (bool): Only the rows appended to the data file since the
+                         last read are read, the rows rejected by the
+                         earlier reads are kept in the file
+          keep (bool): Also keep the rejected rows in memory, see kept_rows()
+        """
+        self.counts = {}
+        self.rows = 0
+        self._kept = [] if keep else None
+        if self.filepath is None:
+            return
+        exists = Utils.file_exists(self.filepath)
+        if exists and not append:
+            os.remove(self.filepath)
+        self._write_header = not (append and exists and os.path.getsize(self.filepath))
+
+    def add(self, df, failures, rejected):
+        """Writes out the rejected rows of a frame, or a chunk of it.
+
+        Args:
+          df (pandas.DataFrame): Rows as read from the data file
+          failures (dict): Failed checks, as returned by validate()
+          rejected (numpy.ndarray): Rows to quarantine
+        """
+        count = int(rejected.sum())
+        if not count:
+            return
+        rows = _as_written(df[rejected])
+        reasons = pd.Series("", index=rows.index)
+        for code, failed in failures.items():
+            failed = failed[rejected]
+            if failed.any():
+                self.counts[code] = self.counts.get(code, 0) + int(failed.sum())
+                reasons[failed] += code + ";"
+        rows = rows.assign(**{REASONS_COLUMN: reasons.str.rstrip(";")})
+        if self._kept is not None:
+            self._kept.append(rows)
+        if self.filepath is not None:
+            os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+            rows.to_csv(self.filepath, mode="a", header=self._write_header, index=False)
+            self._write_header = False
+        self.rows += count
+
+    def kept_rows(self):
+        """Returns: DataFrame of the rows rejected since start(keep=True) as
+                 written to the file, None when there are none"""
+        return pd.concat(self._kept) if self._kept else None
+
+    def restore(self, rows_path, rows, counts):
+        """Quarantines the rows rejected by an earlier read of the same data
+        file, in place of reading it again.
+
+        Args:
+          rows_path (str): csv file of the rejected rows, as written by
+                           add(). None when no row was rejected
+          rows (int): Number of rejected rows
+          counts (dict): Map of each reason code to its number of rows
+        """
+        self.start()
+        self.rows = rows
+        self.counts = dict(counts)
+        if self.filepath is not None and rows_path is not None:
+            os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+            shutil.copyfile(rows_path, self.filepath)
+            self._write_header = False
+
+    def finish(self):
+        """Reports the number of rows rejected by each check"""
+        if not self.rows:
+            INFO("All rows passed validation")
+            return
+        WARN("Quarantined %d rows failing validation in %s", self.rows,
+             self.filepath or "no file")
+        for code, count in sorted(self.counts.items(), key=lambda item: (-item[1], item[0])):
+            INFO("  %-40s %d", code, count)
@@ -0,0 +1,75 @@
+"""Watch mode, regenerating the website whenever the data file changes.
+
+The data file is polled for changes of its size or modification time. A
+change is only acted upon once the file has stopped changing for the
+debounce period, so that a burst of appends leads to a single regeneration.
+The Loader, along with the imported libraries, applied style and ingested
+counts, stays in memory between regenerations.
+"""
+import os
+import time
+
+from lib.logger import INFO, LOGEXCEPTION
+
+
+class Watcher(object):
+    def __init__(self, loader, interval=0.2, debounce=0.3):
+        """
+        Args:
+          loader (Loader): Loader of the data file to watch
+          interval (float): Seconds between polls of the data file
+          debounce (float): Seconds the data file has to stay unchanged
+                            before the website is regenerated
+        """
+        self.loader = loader
+        self.interval = interval
+        self.debounce = debounce
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.loader.data_file_path)
+        except OSError:
+            # Being replaced, eg: renamed over by an editor
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _wait_until_settled(self, signature):
+        while True:
+            time.sleep(self.debounce)
+            current = self._signature()
+            if current == signature and current is not None:
+                return current
+            signature = current
+
+    def run(self, max_refreshes=None):
+        """Generates the website, then regenerates it on every change of the
+        data file until interrupted.
+
+        Args:
+          max_refreshes (int): Stop after this many regenerations. Defaults
+                               to None, which watches forever
+        """
+        signature = self._signature()
+        self.loader.run()
+        INFO("Watching %s for changes", self.loader.data_file_path)
+        refreshes = 0
+        try:
+            while max_refreshes is None or refreshes < max_refreshes:
+                time.sleep(self.interval)
+                current = self._signature()
+                if current == signature:
+                    continue
+                signature = self._wait_until_settled(current)
+                started = time.perf_counter()
+                try:
+                    self.loader.refresh()
+                except Exception:
+                    # A bad append should not end the watch, the next change
+                    # is picked up all the same
+                    LOGEXCEPTION("Could not regenerate the website")
+                    continue
+                finally:
+                    refreshes += 1
+                INFO("Regenerated the website in %.3fs", time.perf_counter() - started)
+        except KeyboardInterrupt:
+            INFO("Stopped watching %s", self.loader.data_file_path)